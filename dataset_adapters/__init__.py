@@ -0,0 +1,145 @@
+import os
+import asyncio
+import contextlib
+import logging
+from typing import Coroutine
+from dotenv import load_dotenv
+from tqdm.asyncio import tqdm_asyncio
+from dataset_models import ResponseSet
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# How many subsets of a dataset are evaluated at the same time. 0 = no limit.
+# Requests are capped by BATCH_SIZE anyway. This bounds how many subsets are in flight (and held in memory) at once, so finished subsets are judged and stored early.
+MAX_CONCURRENT_SUBSETS = int(os.getenv("MAX_CONCURRENT_SUBSETS") or 4)
+
+async def run_subset_tasks(subset_tasks: list[Coroutine], desc: str):
+    """
+    Start every subset task at once and wait for them with a progress bar. How many of them evaluate at the same time is bounded by the subset semaphore of the adapter.
+    
+    The tasks run in an `asyncio.TaskGroup`: if a subset fails, the subsets still running are cancelled before the error is raised, so that none of them keeps sending requests or writing results in the background. Their results are not stored and their scores are not reported.
+    
+    :params list subset_tasks: Subset coroutines, not started yet.
+    :params str desc: Progress bar description.
+    :raise Exception: The error of the failed subset, as it was raised.
+    :raise ExceptionGroup: If several subsets failed before the others were cancelled, with the errors of every failed subset.
+    """
+    try:
+        async with asyncio.TaskGroup() as task_group:
+            tasks = [task_group.create_task(subset_task) for subset_task in subset_tasks]
+            # No progress bar when stderr is not a terminal e.g. redirected to a log file. Redraw at most once a second.
+            for completed_task in tqdm_asyncio.as_completed(tasks, desc=desc, position=0, disable=None, mininterval=1.0):
+                await completed_task
+    except ExceptionGroup as group:
+        # Keep the usual exception for a single failure, so that callers can still catch it by type
+        if len(group.exceptions) == 1:
+            raise group.exceptions[0] from None
+        raise
+
+class ResultWriter:
+    """
+    Store result files in the background. Subset tasks queue their rows with `put` and move on to free their slot, instead of waiting for the file to be written (an xlsx file is rewritten as a whole). Rows queued for the same file meanwhile are written with a single `store_to`.
+    
+    Call `close` once all subsets finish, also when some of them failed. It waits for every queued write and raises the first write error.
+    """
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.writer_task: asyncio.Task | None = None
+        self.error: Exception | None = None
+    
+    def put(self, file_path: str, rows: list[dict]):
+        """
+        :params str file_path: The file to append the rows to. Format supported: same as ResponseSet.store_to.
+        :params list[dict] rows: Response objects. Do not modify them afterwards.
+        """
+        if self.writer_task is None:
+            self.writer_task = asyncio.create_task(self._write_queued())
+        self.queue.put_nowait((file_path, rows))
+    
+    async def _write_queued(self):
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            rows_by_path: dict[str, list[dict]] = {}
+            for file_path, rows in batch:
+                rows_by_path.setdefault(file_path, []).extend(rows)
+            # Different files are written concurrently, bounded by STORE_MAX_WORKERS
+            file_paths = list(rows_by_path)
+            results = await asyncio.gather(*(ResponseSet(rows_by_path[file_path]).astore_to(file_path) for file_path in file_paths), return_exceptions=True)
+            for file_path, result in zip(file_paths, results):
+                if isinstance(result, Exception):
+                    logger.error("Failed to store %s: %s", file_path, result)
+                    if self.error is None:
+                        self.error = result
+            for _ in batch:
+                self.queue.task_done()
+    
+    async def close(self):
+        """
+        Wait until every queued row is written.
+        
+        :raise: The first error raised while writing, if any
+        """
+        if self.writer_task is None:
+            return
+        await self.queue.join()
+        self.writer_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self.writer_task
+        self.writer_task = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+class ScoreBuffer:
+    """
+    Collect the score summaries of a multi-subset evaluation and write score_output_path once at the end, instead of rewriting it (usually an xlsx file) after every subset.
+    
+    Each score is also appended to a jsonl sidecar (`$score_output_path$.partial.jsonl`) as soon as its subset finishes, so the scores can be recovered if the run is killed. The sidecar is removed after a successful flush.
+    
+    A jsonl score_output_path is append-only already: scores are appended to it directly as they come, without a sidecar or a final write.
+    """
+    def __init__(self, score_output_path: str, result_writer: ResultWriter | None = None):
+        """
+        :params str score_output_path: The score summary file. Format supported: same as ResponseSet.store_to.
+        :params ResultWriter result_writer: Optional. Append to the sidecar in the background with this writer. Close it before `flush`.
+        """
+        self.score_output_path = score_output_path
+        self.result_writer = result_writer
+        self.partial_path = f"{score_output_path}.partial.jsonl"
+        self.scores: list[dict] = []
+        self.append_directly = os.path.splitext(score_output_path)[1] == ".jsonl"
+        if self.append_directly:
+            self.partial_path = score_output_path
+        # Never delete the leftovers of an interrupted run
+        self.keep_partial = not self.append_directly and os.path.exists(self.partial_path)
+        if self.keep_partial:
+            logger.warning("Found scores of an interrupted run in %s. New scores are appended to it and the file is kept.", self.partial_path)
+    
+    async def add(self, score_result: dict):
+        """
+        :params dict score_result: The score summary of a finished subset.
+        """
+        if not self.append_directly:
+            self.scores.append(score_result)
+        if self.result_writer is not None:
+            self.result_writer.put(self.partial_path, [score_result])
+        else:
+            await ResponseSet([score_result]).astore_to(self.partial_path)
+    
+    async def flush(self):
+        """
+        Store all collected scores to score_output_path. Call it once after all subsets finish, also when some of them failed.
+        """
+        if not self.scores:
+            return
+        await ResponseSet(self.scores).astore_to(self.score_output_path)
+        self.scores = []
+        if not self.keep_partial:
+            try:
+                os.remove(self.partial_path)
+            except FileNotFoundError:
+                pass
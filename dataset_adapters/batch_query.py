@@ -2,6 +2,7 @@ from worker import Worker
 from dataset_models import QuerySet, ResponseSet
 from pathfinders import parse_filename_from_path, sanitize_pathname
 import os
+import asyncio
 
 async def batch_query(query_file_path: str, workers: list[Worker], output_dir="results/batch_query", query_key="query", test_mode=False, enable_metrics=False):
     """
@@ -24,10 +25,13 @@ async def batch_query(query_file_path: str, workers: list[Worker], output_dir="r
     if not os.path.isdir(output_dir):
         raise FileNotFoundError(f"Destination results directory is not found: {output_dir}")
     
-    query_set = QuerySet(query_file_path)
+    # Connections and (optionally) models are warmed up before the query file is read
+    await asyncio.gather(*[worker.warm_up() for worker in workers])
+    
+    # Test mode: only the first 3 queries are read
+    query_set = QuerySet(query_file_path, nrows=3 if test_mode else 0)
         
     if test_mode:
-        query_set = query_set[:3]
         output_dir = os.path.join("test/", output_dir)
             
     QUERY_SET_NAME = parse_filename_from_path(query_file_path)
@@ -35,10 +39,16 @@ async def batch_query(query_file_path: str, workers: list[Worker], output_dir="r
     # For aggregated output
     aggregated_response_list = []
     
-    for i, worker in enumerate(workers):
-        model_name = worker.get_params()["model"]
-        model_response_key = f"{model_name}_response"
-        response_set = await worker(query_set, query_key=query_key, response_key=model_response_key).invoke(enable_metrics=enable_metrics)
+    # Workers usually hit different models/endpoints. Dispatch them concurrently, requests are still capped by BATCH_SIZE.
+    # get_params builds a new dict on every call. Read the model names once per run.
+    model_names = [worker.get_params()["model"] for worker in workers]
+    model_response_keys = [f"{model_name}_response" for model_name in model_names]
+    response_sets = await asyncio.gather(*[
+        worker(query_set, query_key=query_key, response_key=model_response_key).invoke(enable_metrics=enable_metrics)
+        for worker, model_response_key in zip(workers, model_response_keys)
+    ])
+    
+    for i, (response_set, model_response_key) in enumerate(zip(response_sets, model_response_keys)):
         response_list = response_set.get_responses()
         if i == 0:
             # First job, initialize response list, no need to aggregate
@@ -46,14 +56,10 @@ async def batch_query(query_file_path: str, workers: list[Worker], output_dir="r
             continue
         if i > 0:
             # Sequential update on existing job response set
-            [existing_item.update(
-                {
-                    model_response_key: aggregating_item[query_key]  
-                }
-                ) for existing_item, aggregating_item in zip(aggregated_response_list, response_list)]
+            ResponseSet(aggregated_response_list).set_column(model_response_key, response_set.get_column(model_response_key))
             
     aggregated_response_set = ResponseSet(aggregated_response_list, query_key=query_key)
     
     output_path = os.path.join(output_dir, sanitize_pathname(f"{QUERY_SET_NAME}_responses.xlsx"))
     
-    aggregated_response_set.store_to(output_path)
\ No newline at end of file
+    await aggregated_response_set.astore_to(output_path)
\ No newline at end of file
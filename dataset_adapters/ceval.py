@@ -1,21 +1,21 @@
 import os
-from tqdm import tqdm
 from dataset_models import QuerySet, ResponseSet
 from typing import Callable
 from worker import Worker
-from pathfinders import list_files_in_directory, craft_result_path, craft_eval_dir_path, parse_filename_from_path
+from dataset_adapters import MAX_CONCURRENT_SUBSETS, ResultWriter, ScoreBuffer, run_subset_tasks
+from pathfinders import list_files_in_directory_cached, craft_result_path, craft_eval_dir_path, parse_filename_from_path
 from judgers.presets import STRICT_MATCH
 from resultfile_logger import log_resultfile
 import asyncio
+import contextlib
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 JUDGER=STRICT_MATCH
 
 @DeprecationWarning
-async def conduct_ceval(dataset_dir: str, worker: Worker, response_preprocessor: Callable[[str], str], results_dir="results", score_output_path="model_results.xlsx", shuffled=False, subset_max_size=0, test_mode=False, enable_metrics=False):
+async def conduct_ceval(dataset_dir: str, worker: Worker, response_preprocessor: Callable[[str], str], results_dir="results", score_output_path="model_results.xlsx", shuffled=False, subset_max_size=0, test_mode=False, enable_metrics=False, max_concurrent_subsets=MAX_CONCURRENT_SUBSETS):
     """
     Conduct a ceval test. Before evaluation, create a worker instance.
     
@@ -33,10 +33,13 @@ async def conduct_ceval(dataset_dir: str, worker: Worker, response_preprocessor:
     :params int subset_max_size: 0 (default) = eval all entries; 50 = the first 50 entries of each subfield, etc.
     :params test_mode: only first 3 questions from first subset under dataset_dir will be evaluated. Only for debug purposes.
     :params bool enable_metrics: Whether to read "usage" key from response body. Only available when the server enabled metrics.
+    :params int max_concurrent_subsets: How many subsets are evaluated at the same time. 0 = all at once. Default to MAX_CONCURRENT_SUBSETS in .env file (4).
 
     """
     DATASET_NAME = "ceval"
     MODEL = worker.get_params()["model"]
+    # Same for every subset
+    SCORE_META = {"dataset": DATASET_NAME, "model": MODEL}
     ANSWER_KEY = "answer"
     QUERY_KEY = "question"
     # Check if both dataset_dir and results_dir exist
@@ -45,59 +48,76 @@ async def conduct_ceval(dataset_dir: str, worker: Worker, response_preprocessor:
     if not os.path.isdir(results_dir):
         raise FileNotFoundError(f"Destination results directory is not found: {results_dir}")
     
-    async def task(query_set: QuerySet):
-        response_set = await worker(query_set, QUERY_KEY).invoke(enable_metrics=enable_metrics)
+    # Connections and (optionally) the model are warmed up before the dataset is read
+    await worker.warm_up()
+    
+    subset_semaphore = asyncio.Semaphore(max_concurrent_subsets) if max_concurrent_subsets > 0 else contextlib.nullcontext()
+    
+    def prepare_subset(subset_path: str) -> QuerySet:
+        """
+        Read a subset file and build the query set to evaluate. Runs in a worker thread, so that parsing overlaps with the requests of other subsets.
+        """
+        # Test mode: Only the first 3 queries will be evaluated.
+        raw_dataset = QuerySet(subset_path, nrows=3 if test_mode else 0)
         
-        subset_path = query_set.get_path()
-        # this get_path method can return None when query_set is instantiated with a literal query string list. However, this wouldn't happen in dataset evaluation. No need for None safety validation.
+        # The original ceval test set contains 5 mcq fields. Need to merge them into one.
+        # Keys are merged into a question field, overwriting the existing field
+        if shuffled:
+            # Shuffle the options first, then merge them in one pass
+            dataset = raw_dataset.shuffled_merge(ANSWER_KEY, ANSWER_KEY, QUERY_KEY, "question")
+        else:
+            dataset = raw_dataset.merge_keys([QUERY_KEY, "A", "B", "C", "D"], "question")
+        return dataset
+    
+    async def task(subset_path: str):
+        async with subset_semaphore:
+            # Only subsets holding the semaphore are in memory
+            query_set = await asyncio.to_thread(prepare_subset, subset_path)
+            if test_mode:
+                # Preview the query set just read, instead of reading the file again
+                preview_eval_counts([query_set])
+            # Create a hint message
+            print(f"Conducting test: {query_set.get_path()} ({len(query_set)})")
+            
+            response_set = await worker(query_set, QUERY_KEY).invoke(enable_metrics=enable_metrics)
 
-        # Use query set path basename as eval name as each subset should have its distinctive name.
-        score_result = await response_set.judge(answer_key=ANSWER_KEY, 
-                                          eval_name=f"{parse_filename_from_path(subset_path)}", 
-                                          response_preprocessor = response_preprocessor,
-                                          judger=JUDGER)
+            # Use query set path basename as eval name as each subset should have its distinctive name.
+            score_result = await response_set.judge(answer_key=ANSWER_KEY, 
+                                              eval_name=parse_filename_from_path(subset_path), 
+                                              response_preprocessor = response_preprocessor,
+                                              judger=JUDGER)
         
-        # Store response with score info updated in response_set
-        response_set.store_to(craft_result_path(query_set, results_dir, DATASET_NAME, MODEL))
+            # Store response with score info updated in response_set
+            result_writer.put(craft_result_path(query_set, results_dir, DATASET_NAME, MODEL), response_set.get_responses())
 
-        score_result.update({
-            "dataset": DATASET_NAME,
-            "model": MODEL
-            })
-        if enable_metrics:
-            score_result.update({"total_output_tokens": sum([query["output_tokens"] for query in response_set.get_responses()])})
-        ResponseSet([score_result]).store_to(score_output_path)
+            score_result.update(SCORE_META)
+            if enable_metrics:
+                score_result.update({"total_output_tokens": sum(query["output_tokens"] for query in response_set.get_responses()), "cache_hits": sum(query["cached"] for query in response_set.get_responses())})
+            await score_buffer.add(score_result)
         
-    # Create QuerySet instances from dataset paths
-    subset_paths = list_files_in_directory(dataset_dir, ".csv")
-    datasets = [QuerySet(subset_path) for subset_path in subset_paths]
+    # Subset files are read inside the tasks, see prepare_subset
+    subset_paths = list_files_in_directory_cached(dataset_dir, file_ext=".csv")
     
     # Test mode: Only the first subset will be evaluated.
     if test_mode:
-        preview_eval_counts(datasets)
-        datasets = [datasets[0]]
+        subset_paths = subset_paths[:1]
         results_dir = os.path.join("test/", results_dir)
         score_output_path = os.path.join("test/", score_output_path)
+    
+    # Subsets run concurrently: one subset is parsed and prepared while the others wait for their requests.
+    tasks = [task(subset_path) for subset_path in subset_paths]
         
-    tasks = []
-        
-    for raw_dataset in datasets:
-        # The original ceval test set contains 5 mcq fields. Need to merge them into one.
-        # Test mode: Only the first 3 queries will be evaluated.
-        if test_mode:
-            raw_dataset = raw_dataset[:3]
-        # Keys are merged into a question field, overwriting the existing field
-        dataset = raw_dataset.merge_keys([QUERY_KEY, "A", "B", "C", "D"], "question")
-        
-        if shuffled:
-            raw_dataset = raw_dataset.mcq_shuffle(ANSWER_KEY, ANSWER_KEY)
-        # Create a hint message
-        dataset_size = len(dataset)
-        print(f"Conducting test: {dataset.get_path()} ({dataset_size})")
-        tasks.append(task(dataset))
-        
-    for completed_task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc=f"{DATASET_NAME}: Task Completion Progress", position=0):
-        await completed_task
+    # Result files are written in the background, so that a subset frees its slot as soon as it is judged
+    result_writer = ResultWriter()
+    score_buffer = ScoreBuffer(score_output_path, result_writer)
+    try:
+        await run_subset_tasks(tasks, desc=f"{DATASET_NAME}: Task Completion Progress")
+    finally:
+        try:
+            await result_writer.close()
+        finally:
+            # Keep the scores of finished subsets even if another subset failed
+            await score_buffer.flush()
             
     # Initialize a RESULTFILE in evaluation results directory.
     def log():
@@ -110,10 +130,8 @@ async def conduct_ceval(dataset_dir: str, worker: Worker, response_preprocessor:
     log()
     
 def preview_eval_counts(query_set_list: list[QuerySet]):
-    preview_message = f"""
-    ======EVAL CHECKLIST======
-    |\tEval name\t|\tSize\t|
-    {"\n".join([f"|\t{query_set.get_path()}\t|\t{len(query_set)}|" for query_set in query_set_list])}
-    ============
-    """
-    logger.info(preview_message)
\ No newline at end of file
+    # Skip building the checklist when INFO is not logged
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    rows = "\n".join(f"|\t{query_set.get_path()}\t|\t{len(query_set)}|" for query_set in query_set_list)
+    logger.info("\n======EVAL CHECKLIST======\n|\tEval name\t|\tSize\t|\n%s\n============", rows)
\ No newline at end of file
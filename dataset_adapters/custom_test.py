@@ -2,11 +2,11 @@ from worker import Worker
 from dataset_models import QuerySet, ResponseSet
 from pathfinders import parse_filename_from_path, sanitize_pathname
 import os
+import asyncio
 from judgers.presets import STRICT_MATCH
 from text_preprocessors import as_is
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 async def run_test(test_file_path: str, workers: list[Worker], output_dir="results/custom_tests",test_mode=False, judging_algorithm=STRICT_MATCH, response_preprocessor=as_is, query_key="query", answer_key="answer", enable_metrics=False):
@@ -22,6 +22,9 @@ async def run_test(test_file_path: str, workers: list[Worker], output_dir="resul
     :params query_key: The key for evaluation queries. Set as your query file requires.
     :params answer_key: Conduct score judging based on this key. Required for score judging.
     :params bool enable_metrics: Whether to read "usage" key from response body. Only available when the server enabled metrics.
+    :raise ValueError: If two workers evaluate the same model. Their responses and scores would end up in the same columns.
+
+    Responses of each worker are stored in "<model>_response". With a single worker, scores go to the usual "score" and "judged_content" columns. With several workers, each worker's scores go to "<model>_score" and "<model>_judged_content".
     """
     
     # Check if both query_file_path and output_dir exist
@@ -30,24 +33,36 @@ async def run_test(test_file_path: str, workers: list[Worker], output_dir="resul
     if not os.path.isdir(output_dir):
         raise FileNotFoundError(f"Destination results directory is not found: {output_dir}")
     
+    # Connections and (optionally) models are warmed up before the query file is read
+    await asyncio.gather(*[worker.warm_up() for worker in workers])
+    
     if not answer_key:
         raise ValueError(f"Answer_key is required for score judging. Got {answer_key}.")
     
-    query_set = QuerySet(test_file_path)
+    # Test mode: only the first 3 queries are read
+    query_set = QuerySet(test_file_path, nrows=3 if test_mode else 0)
     preview_eval_counts([query_set])
     
     if test_mode:
-        query_set = query_set[:3]
         output_dir = os.path.join("test/", output_dir)
             
     QUERY_SET_NAME = parse_filename_from_path(test_file_path)
     # For aggregated output
     aggregated_response_list = []
     
-    for i, worker in enumerate(workers):
-        model_name = worker.get_params()["model"]
-        model_response_key = f"{model_name}_response"
-        response_set = await worker(query_set, query_key=query_key, response_key=model_response_key).invoke(enable_metrics=enable_metrics)
+    # Workers usually hit different models/endpoints. Dispatch them concurrently, requests are still capped by BATCH_SIZE.
+    # get_params builds a new dict on every call. Read the model names once per run.
+    model_names = [worker.get_params()["model"] for worker in workers]
+    model_response_keys = [f"{model_name}_response" for model_name in model_names]
+    # Responses, and later scores, of each worker are stored in columns named after its model
+    if len(set(model_names)) != len(model_names):
+        raise ValueError(f"Workers must evaluate distinct models. Got {model_names}.")
+    response_sets = await asyncio.gather(*[
+        worker(query_set, query_key=query_key, response_key=model_response_key).invoke(enable_metrics=enable_metrics)
+        for worker, model_response_key in zip(workers, model_response_keys)
+    ])
+    
+    for i, (response_set, model_response_key) in enumerate(zip(response_sets, model_response_keys)):
         response_list = response_set.get_responses()
         if i == 0:
             # First job, initialize response list, no need to aggregate
@@ -56,34 +71,36 @@ async def run_test(test_file_path: str, workers: list[Worker], output_dir="resul
             
         if i > 0:
             # Sequential update on existing job response set
-            [existing_item.update(
-                {
-                    model_response_key: aggregating_item[model_response_key]  
-                }
-                ) for existing_item, aggregating_item in zip(aggregated_response_list, response_list)]
+            ResponseSet(aggregated_response_list).set_column(model_response_key, response_set.get_column(model_response_key))
             
     aggregated_response_set = ResponseSet(aggregated_response_list, query_key=query_key)
     
-    for worker in workers:
-        model_name = worker.get_params()["model"]
-        model_response_key = f"{model_name}_response"
-        model_eval_name = f"{model_name}"
-        await aggregated_response_set.judge(answer_key=answer_key,
+    # Each judge writes its own score columns, so the workers can be judged concurrently.
+    # A single worker keeps the plain "score"/"judged_content" columns.
+    if len(model_names) == 1:
+        score_keys, judged_content_keys = ["score"], ["judged_content"]
+    else:
+        score_keys = [f"{model_name}_score" for model_name in model_names]
+        judged_content_keys = [f"{model_name}_judged_content" for model_name in model_names]
+    await asyncio.gather(*[
+        aggregated_response_set.judge(answer_key=answer_key,
                                       context_key=query_key,
-                                      eval_name=model_eval_name,
+                                      eval_name=model_name,
                                       response_preprocessor=response_preprocessor,
                                       judger=judging_algorithm,
-                                      foreign_response_key=model_response_key)
+                                      foreign_response_key=model_response_key,
+                                      score_key=score_key,
+                                      judged_content_key=judged_content_key)
+        for model_name, model_response_key, score_key, judged_content_key in zip(model_names, model_response_keys, score_keys, judged_content_keys)
+    ])
     
     output_path = os.path.join(output_dir, sanitize_pathname(f"{QUERY_SET_NAME}_results.xlsx"))
     
-    aggregated_response_set.store_to(output_path)
+    await aggregated_response_set.astore_to(output_path)
     
 def preview_eval_counts(query_set_list: list[QuerySet]):
-    preview_message = f"""
-    ======EVAL CHECKLIST======
-    |\tEval name\t|\tSize\t|
-    {"\n".join([f"|\t{query_set.get_path()}\t|\t{len(query_set)}|" for query_set in query_set_list])}
-    ============
-    """
-    logger.info(preview_message)
\ No newline at end of file
+    # Skip building the checklist when INFO is not logged
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    rows = "\n".join(f"|\t{query_set.get_path()}\t|\t{len(query_set)}|" for query_set in query_set_list)
+    logger.info("\n======EVAL CHECKLIST======\n|\tEval name\t|\tSize\t|\n%s\n============", rows)
\ No newline at end of file
@@ -2,12 +2,10 @@ from worker import Worker
 from dataset_models import QuerySet, ResponseSet
 import os
 import logging
-from external_eval_methods.humaneval_eval.evaluation import humaneval_eval_raw_pass
 from pathfinders import craft_result_path, craft_eval_dir_path
 from resultfile_logger import log_resultfile
 from text_preprocessors import clean_humaneval_preprocessor, clean_humaneval_cot_preprocessor
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # HumanEval has dedicated preprocessing methods. clean_humaneval_preprocessor is for non-cot eval and the other one, you bet.
@@ -23,47 +21,65 @@ async def conduct_humaneval(humaneval_file_path: str, worker: Worker, results_di
     :params bool test_mode: only the first 3 questions are tested. Only for debug purposes.
     :params bool enable_metrics: Whether to read "usage" key from response body. Only available when the server enabled metrics.
     """
+    await conduct_humaneval_family(humaneval_file_path, worker, "humaneval", results_dir=results_dir, score_output_path=score_output_path, test_mode=test_mode, enable_metrics=enable_metrics)
+
+async def conduct_humaneval_family(file_path: str, worker: Worker, dataset_name: str, results_dir="results", score_output_path="model_results.xlsx", test_mode=False, enable_metrics=False):
+    """
+    Conduct an evaluation on a humaneval-formatted test file, e.g. humaneval and humanevalplus. They share query/response keys, preprocessing and scoring.
+
+    :params file_path: The test file path.
+    :params worker: The industrious worker.
+    :params str dataset_name: Used in result paths and logs e.g. humaneval, humanevalplus.
+    :params str results_dir: Store result file in this directory. Default to: results
+    :params bool test_mode: only the first 3 questions are tested. Only for debug purposes.
+    :params bool enable_metrics: Whether to read "usage" key from response body. Only available when the server enabled metrics.
+    """
+    # Imported here, so that importing this module (e.g. from run.py) does not load its evaluation pipeline unless this adapter runs
+    from external_eval_methods.humaneval_eval.evaluation import humaneval_eval_raw_pass
     # humaneval specific settings, do not modify
     QUERY_KEY = "prompt"
     RESPONSE_KEY = "completion"
-    DATASET_NAME = "humaneval"
+    DATASET_NAME = dataset_name
     MODEL = worker.get_params()["model"]
     # Check if both query_file_path and output_dir exist
-    if not os.path.isfile(humaneval_file_path):
-        raise FileNotFoundError(f"Speficied humaneval file is not found: {humaneval_file_path}")
+    if not os.path.isfile(file_path):
+        raise FileNotFoundError(f"Speficied {DATASET_NAME} file is not found: {file_path}")
     if not os.path.isdir(results_dir):
         raise FileNotFoundError(f"Destination results directory is not found: {results_dir}")
     
-    query_set = QuerySet(humaneval_file_path)
+    # Connections and (optionally) the model are warmed up before the dataset is read
+    await worker.warm_up()
     
+    # Test mode: only the first 3 questions are read
+    query_set = QuerySet(file_path, nrows=3 if test_mode else 0)
     if test_mode:
-        query_set = query_set[:3]
         results_dir = os.path.join("test/", results_dir)
         score_output_path = os.path.join("test/", score_output_path)
         
     
-    logger.info(f"Conducting test: {humaneval_file_path} ({len(query_set)})")
+    logger.info(f"Conducting test: {file_path} ({len(query_set)})")
     response_set: ResponseSet = await worker(query_set, query_key=QUERY_KEY, response_key=RESPONSE_KEY).invoke(enable_metrics=enable_metrics)
     
-    # Score judging for IFEval
-    score_entry = humaneval_eval_raw_pass(response_set, humaneval_file_path, response_preprocessor=RESPONSE_PREPROCESSOR)
+    # Score judging
+    score_entry = humaneval_eval_raw_pass(response_set, file_path, response_preprocessor=RESPONSE_PREPROCESSOR)
     score_entry.update({
         "dataset": DATASET_NAME,
         "model": MODEL
         })
     if enable_metrics:
-        score_entry.update({"total_output_tokens": sum([query["output_tokens"] for query in response_set.get_responses()])})
+        score_entry.update({"total_output_tokens": sum(query["output_tokens"] for query in response_set.get_responses()), "cache_hits": sum(query["cached"] for query in response_set.get_responses())})
     
     # Store (Append to) result file
     result_filename = craft_result_path(query_set, results_dir, DATASET_NAME, MODEL, file_ext="xlsx")
-    response_set.store_to(result_filename)
-    # Store ifeval score to score_output_path
-    ResponseSet([score_entry]).store_to(score_output_path)
+    # Written in worker threads, so that other evaluations running on the event loop are not blocked meanwhile
+    await response_set.astore_to(result_filename)
+    # Store score to score_output_path
+    await ResponseSet([score_entry]).astore_to(score_output_path)
     
     # Initialize a RESULTFILE in evaluation results directory.
     def log():
         params = {
-            "test_set_type": "humaneval",
+            "test_set_type": DATASET_NAME,
             "judging_method": humaneval_eval_raw_pass.__name__
         }
         eval_dir = craft_eval_dir_path(results_dir, DATASET_NAME, MODEL)
@@ -71,10 +87,13 @@ async def conduct_humaneval(humaneval_file_path: str, worker: Worker, results_di
     log()
     
 
-def make_system_prompt():
-    return """You are a coder. Complete the following code block according to the docstring with proper indentation. Provide ONLY the completion without additional content.
+SYSTEM_PROMPT = """You are a coder. Complete the following code block according to the docstring with proper indentation. Provide ONLY the completion without additional content.
 """
+PROMPT_SUFFIX = """# YOUR COMPLETION STARTS HERE
+"""
+
+def make_system_prompt():
+    return SYSTEM_PROMPT
 
 def make_prompt_suffix():
-    return """# YOUR COMPLETION STARTS HERE
-"""
\ No newline at end of file
+    return PROMPT_SUFFIX
\ No newline at end of file
@@ -2,12 +2,10 @@ from worker import Worker
 from dataset_models import QuerySet, ResponseSet
 import os
 import logging
-from external_eval_methods.instruction_following_eval.evaluation_main import ifeval_judge_strict
 from pathfinders import craft_result_path, craft_eval_dir_path
 from text_preprocessors import as_is, remove_think_tags
 from resultfile_logger import log_resultfile
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # IfEval does not need response preprocessing (use as_is) unless you are evaluating reasoning models.
@@ -24,6 +22,8 @@ async def conduct_ifeval(ifeval_src_file_path: str, worker: Worker, results_dir=
     :params bool test_mode: only the first 3 questions will be evaluated. Only for debug purposes.
     :params bool enable_metrics: Whether to read "usage" key from response body. Only available when the server enabled metrics.
     """
+    # Imported here, so that importing this module (e.g. from run.py) does not load absl/nltk/langdetect unless this adapter runs
+    from external_eval_methods.instruction_following_eval.evaluation_main import ifeval_judge_strict
     # ifeval specific settings, do not modify
     QUERY_KEY = "prompt"
     RESPONSE_KEY = "response"
@@ -40,10 +40,12 @@ async def conduct_ifeval(ifeval_src_file_path: str, worker: Worker, results_dir=
     if not os.path.isdir(results_dir):
         raise FileNotFoundError(f"Destination results directory is not found: {results_dir}")
     
-    query_set = QuerySet(ifeval_src_file_path)
+    # Connections and (optionally) the model are warmed up before the dataset is read
+    await worker.warm_up()
     
+    # Test mode: only the first 3 questions are read
+    query_set = QuerySet(ifeval_src_file_path, nrows=3 if test_mode else 0)
     if test_mode:
-        query_set = query_set[:3]
         results_dir = os.path.join("test/", results_dir)
         score_output_path = os.path.join("test/", score_output_path)
         
@@ -58,12 +60,13 @@ async def conduct_ifeval(ifeval_src_file_path: str, worker: Worker, results_dir=
         "model": MODEL
         })
     if enable_metrics:
-        score_entry.update({"total_output_tokens": sum([query["output_tokens"] for query in response_set.get_responses()])})
+        score_entry.update({"total_output_tokens": sum(query["output_tokens"] for query in response_set.get_responses()), "cache_hits": sum(query["cached"] for query in response_set.get_responses())})
     # Store (Append to) result file
     result_filename = craft_result_path(query_set, results_dir, DATASET_NAME, MODEL, file_ext="jsonl")
-    response_set.store_to(result_filename)
+    # Written in worker threads, so that other evaluations running on the event loop are not blocked meanwhile
+    await response_set.astore_to(result_filename)
     # Store ifeval score to score_output_path
-    ResponseSet([score_entry]).store_to(score_output_path)
+    await ResponseSet([score_entry]).astore_to(score_output_path)
     
     # Initialize a RESULTFILE in evaluation results directory.
     def log():
@@ -1,20 +1,21 @@
 import asyncio
+import contextlib
+import functools
 from typing import Callable
-from tqdm import tqdm
 from dataset_models import QuerySet, ResponseSet
 from judgers.presets import STRICT_MATCH
-from pathfinders import craft_eval_dir_path, sanitize_pathname, strip_trailing_slashes_from_path
+from pathfinders import craft_eval_dir_path, sanitize_pathname
 from resultfile_logger import log_resultfile
 from worker import Worker
+from dataset_adapters import MAX_CONCURRENT_SUBSETS, ResultWriter, ScoreBuffer, run_subset_tasks
 import os
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 JUDGER = STRICT_MATCH
 
-async def conduct_mmlu_pro(mmlu_pro_file_path: str, worker: Worker, response_preprocessor: Callable[[str], str], results_dir="results", score_output_path="model_results.xlsx", test_mode=False, subset_max_size=0, enable_metrics=False):
+async def conduct_mmlu_pro(mmlu_pro_file_path: str, worker: Worker, response_preprocessor: Callable[[str], str], results_dir="results", score_output_path="model_results.xlsx", test_mode=False, subset_max_size=0, enable_metrics=False, max_concurrent_subsets=MAX_CONCURRENT_SUBSETS):
     """
     Conduct an mmlu pro evaluation. Before calling the method, create a worker.
 
@@ -26,9 +27,12 @@ async def conduct_mmlu_pro(mmlu_pro_file_path: str, worker: Worker, response_pre
     :params bool test_mode: If enabled, only the first 3 subsets (in alphabetical order) will be tested. Output files will be placed under test/ directory. For debug purposes. Default to False.
     :params int subset_max_size: 0 (default) = eval all entries; 50 = the first 50 entries of each category, etc.
     :params bool enable_metrics: Whether to read "usage" key from response body. Only available when the server enabled metrics.
+    :params int max_concurrent_subsets: How many subsets are evaluated at the same time. 0 = all at once. Default to MAX_CONCURRENT_SUBSETS in .env file (4).
     """
     DATASET_NAME = "mmlu_pro"
     MODEL = worker.get_params()["model"]
+    # Same for every subset
+    SCORE_META = {"dataset": DATASET_NAME, "model": MODEL}
     ANSWER_KEY = "answer"
     QUERY_KEY = "question"
     OPTIONS_KEY = "options"
@@ -41,10 +45,16 @@ async def conduct_mmlu_pro(mmlu_pro_file_path: str, worker: Worker, response_pre
         raise FileNotFoundError(
             f"Destination results directory is not found: {results_dir}")
     
-    giant_query_set = QuerySet(mmlu_pro_file_path)
+    # Connections and (optionally) the model are warmed up before the dataset is read
+    await worker.warm_up()
     
-    # Split the query set by identifiers ("discipline/field/subfield") first.
-    query_sets_by_categories = giant_query_set.divide_by_keys([CATEGORY_KEY], completeness=True)
+    def load_subsets() -> dict[str, QuerySet]:
+        giant_query_set = QuerySet(mmlu_pro_file_path)
+        # Split the query set by categories first.
+        return giant_query_set.divide_by_keys([CATEGORY_KEY], completeness=True)
+    
+    # Parsed in a worker thread, so that evaluations running alongside keep sending requests meanwhile
+    query_sets_by_categories = await asyncio.to_thread(load_subsets)
     
     # Add test mode prefix to output path and dir 
     if test_mode:
@@ -53,14 +63,18 @@ async def conduct_mmlu_pro(mmlu_pro_file_path: str, worker: Worker, response_pre
         score_output_path = os.path.join("test/", score_output_path)
 
     if subset_max_size > 0:
-        [query_sets_by_categories.update(
-            {category: subset[:subset_max_size]}
-            )
-         for category, subset in query_sets_by_categories.items()]
+        for category, subset in query_sets_by_categories.items():
+            # Slicing copies the query list into a new QuerySet. Skip the categories already within the limit.
+            if len(subset) > subset_max_size:
+                query_sets_by_categories[category] = subset[:subset_max_size]
         
     category_query_set_pairs_sorted_in_alphabetical_order = sorted(list(query_sets_by_categories.items()), key=lambda tup: tup[0])
     if test_mode:
         category_query_set_pairs_sorted_in_alphabetical_order = category_query_set_pairs_sorted_in_alphabetical_order[:3]
+    # Only the subsets to evaluate stay referenced. The rest of the file, i.e. the rows cut by subset_max_size and the subsets skipped in test mode, is freed before the requests start.
+    del query_sets_by_categories
+    
+    subset_semaphore = asyncio.Semaphore(max_concurrent_subsets) if max_concurrent_subsets > 0 else contextlib.nullcontext()
     
     async def task(category: str, query_set: QuerySet):
         """
@@ -72,43 +86,51 @@ async def conduct_mmlu_pro(mmlu_pro_file_path: str, worker: Worker, response_pre
         
         4. Store responses by categories. 
         """
-        # Query structure: [
-        #     {... "question": ..., "options": [...], "answer": ..., ...}
-        # ]:
-        mcq_query_set = make_mcq_from_query_set(query_set, query_key=QUERY_KEY, options_key=OPTIONS_KEY)
-        response_set = await worker(mcq_query_set, query_key=QUERY_KEY).invoke(enable_metrics=enable_metrics)
-        score_summary = await response_set.judge(
-            answer_key=ANSWER_KEY,
-            eval_name=category,
-            response_preprocessor=response_preprocessor)
-        # Score has been annotated in each response object.
-        responses = response_set.get_responses()
+        async with subset_semaphore:
+            # Query structure: [
+            #     {... "question": ..., "options": [...], "answer": ..., ...}
+            # ]:
+            mcq_query_set = await asyncio.to_thread(make_mcq_from_query_set, query_set, query_key=QUERY_KEY, options_key=OPTIONS_KEY)
+            response_set = await worker(mcq_query_set, query_key=QUERY_KEY).invoke(enable_metrics=enable_metrics)
+            score_summary = await response_set.judge(
+                answer_key=ANSWER_KEY,
+                eval_name=category,
+                response_preprocessor=response_preprocessor)
+            # Score has been annotated in each response object.
+            responses = response_set.get_responses()
 
-        # Store the category.
-        ResponseSet(responses).store_to(
-                craft_category_path(
-                    results_dir,
-                    DATASET_NAME,
-                    MODEL,
-                    category,
-                    file_ext="jsonl")
-            )
+            # Store the category.
+            result_writer.put(
+                    craft_category_path(
+                        results_dir,
+                        DATASET_NAME,
+                        MODEL,
+                        category,
+                        file_ext="jsonl"),
+                    responses
+                )
         
-        # Calculate score for each category.
-        score_summary.update({
-            "dataset": DATASET_NAME,
-            "model": MODEL
-            })
-        if enable_metrics:
-            score_summary.update({"total_output_tokens": sum([query["output_tokens"] for query in response_set.get_responses()])})
-        ResponseSet([score_summary]).store_to(score_output_path)
+            # Calculate score for each category.
+            score_summary.update(SCORE_META)
+            if enable_metrics:
+                score_summary.update({"total_output_tokens": sum(query["output_tokens"] for query in response_set.get_responses()), "cache_hits": sum(query["cached"] for query in response_set.get_responses())})
+            await score_buffer.add(score_summary)
     
     tasks = []
     for category, query_set in category_query_set_pairs_sorted_in_alphabetical_order:
         tasks.append(task(category, query_set))
 
-    for completed_task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc=f"{DATASET_NAME}: Task Completion Progress", position=0):
-        await completed_task
+    # Result files are written in the background, so that a subset frees its slot as soon as it is judged
+    result_writer = ResultWriter()
+    score_buffer = ScoreBuffer(score_output_path, result_writer)
+    try:
+        await run_subset_tasks(tasks, desc=f"{DATASET_NAME}: Task Completion Progress")
+    finally:
+        try:
+            await result_writer.close()
+        finally:
+            # Keep the scores of finished subsets even if another subset failed
+            await score_buffer.flush()
         
     # Initialize a RESULTFILE in evaluation results directory.
     def log():
@@ -123,27 +145,41 @@ async def conduct_mmlu_pro(mmlu_pro_file_path: str, worker: Worker, response_pre
 
 def make_mcq_from_query_set(query_set: QuerySet, query_key:str, options_key: str):
     """
-    Create a typical MCQ query set from mmlu pro dataset.
+    Create a typical MCQ query set from mmlu pro dataset. supergpqa shares the same layout and uses it as well.
     
     Source: `[... "options": "[]"]`
     
     query_key will be overwritten by the new mcq query field. e.g. `Q? \\nA. Answer\\nB. Answer...`
     """
-    new_queries = query_set.get_queries()
-    [query_obj.update(
-        {query_key: f"{query_obj[query_key]}\n"
-            + "\n".join(
-                [f"{LETTER}. {CONTENT}" for LETTER, CONTENT
-                    in zip(
-                    "ABCDEFGHIJKLMNOPQRSTUVWXYZ",
-                    query_obj[options_key])])}
-    ) for query_obj in new_queries]
+    # Only query_key is replaced. Copy the query dicts instead of deep copying the options lists.
+    new_queries = [{**query_obj, query_key: format_mcq(query_obj[query_key], query_obj[options_key])} for query_obj in query_set.queries]
     new_query_set = QuerySet(new_queries)
     new_query_set.file_path = query_set.get_path()
     return new_query_set
 
+OPTION_LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+# "A. ", "B. ", ... formatted once instead of once per option of every query
+OPTION_PREFIXES = tuple(f"{letter}. " for letter in OPTION_LETTERS)
+
+@functools.lru_cache(maxsize=None)
+def _mcq_template(option_count: int) -> str:
+    """
+    `{}\nA. {}\nB. {}...` with option_count option fields. Built once per option count.
+    """
+    return "\n".join(["{}", *(f"{prefix}{{}}" for prefix in OPTION_PREFIXES[:option_count])])
+
+def format_mcq(question, options: list) -> str:
+    """
+    `Q?\nA. Answer\nB. Answer...`, filled into the template of its option count with a single `str.format`.
+    """
+    # Options past Z are left out
+    if len(options) > len(OPTION_PREFIXES):
+        options = options[:len(OPTION_PREFIXES)]
+    return _mcq_template(len(options)).format(question, *options)
+
 def craft_category_path(results_dir: str, dataset_name: str, model: str, category: str, file_ext):
-        return f"{strip_trailing_slashes_from_path(results_dir)}/{dataset_name}/{model}/{sanitize_pathname(f"{category}")}.{file_ext}"
+        # The directory part is shared by every category and memoized in craft_eval_dir_path
+        return f"{craft_eval_dir_path(results_dir, dataset_name, model)}/{sanitize_pathname(category)}.{file_ext}"
     
 def preview_eval_counts(query_sets_by_categories: dict[str, QuerySet]):
     preview_message = f"""
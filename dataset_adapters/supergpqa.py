@@ -1,21 +1,22 @@
 import asyncio
+import contextlib
 from typing import Callable
-from tqdm import tqdm
 from dataset_models import QuerySet, ResponseSet
 from judgers.presets import STRICT_MATCH
-from pathfinders import craft_eval_dir_path, sanitize_pathname, strip_trailing_slashes_from_path
+from pathfinders import craft_eval_dir_path, sanitize_pathname
 from resultfile_logger import log_resultfile
 from worker import Worker
+from dataset_adapters import MAX_CONCURRENT_SUBSETS, ResultWriter, ScoreBuffer, run_subset_tasks
+from dataset_adapters.mmlu_pro import make_mcq_from_query_set
 import os
 import logging
 # from qwq_blacklist import blacklist
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 JUDGER = STRICT_MATCH
 
-async def conduct_supergpqa(supergpqa_file_path: str, worker: Worker, response_preprocessor: Callable[[str], str], results_dir="results", score_output_path="model_results.xlsx", subset_max_size=0, test_mode=False, enable_metrics=False):
+async def conduct_supergpqa(supergpqa_file_path: str, worker: Worker, response_preprocessor: Callable[[str], str], results_dir="results", score_output_path="model_results.xlsx", subset_max_size=0, test_mode=False, enable_metrics=False, max_concurrent_subsets=MAX_CONCURRENT_SUBSETS):
     """
     Conduct an superGPQA evaluation. Before calling the method, create a worker.
 
@@ -27,9 +28,12 @@ async def conduct_supergpqa(supergpqa_file_path: str, worker: Worker, response_p
     :params int subset_max_size: 0 (default) = eval all entries; 50 = the first 50 entries of each category, etc.
     :params bool test_mode: If enabled, only the first 3 subsets (in alphabetical order) will be tested. Output files will be placed under test/ directory. For debug purposes. Default to False.
     :params bool enable_metrics: Whether to read "usage" key from response body. Only available when the server enabled metrics.
+    :params int max_concurrent_subsets: How many subsets are evaluated at the same time. 0 = all at once. Default to MAX_CONCURRENT_SUBSETS in .env file (4).
     """
     DATASET_NAME = "supergpqa"
     MODEL = worker.get_params()["model"]
+    # Same for every subset
+    SCORE_META = {"dataset": DATASET_NAME, "model": MODEL}
     ANSWER_KEY = "answer_letter"
     QUERY_KEY = "question"
     OPTIONS_KEY = "options"
@@ -45,11 +49,17 @@ async def conduct_supergpqa(supergpqa_file_path: str, worker: Worker, response_p
     if not os.path.isdir(results_dir):
         raise FileNotFoundError(
             f"Destination results directory is not found: {results_dir}")
+    
+    # Connections and (optionally) the model are warmed up before the dataset is read
+    await worker.warm_up()
 
-    giant_query_set = QuerySet(supergpqa_file_path)
+    def load_subsets() -> dict[str, QuerySet]:
+        giant_query_set = QuerySet(supergpqa_file_path)
+        # Split the query set by identifiers ("discipline/field/subfield") first.
+        return giant_query_set.divide_by_keys([CATEGORY_KEY, CATEGORY_SUB_KEY_1, CATEGORY_SUB_KEY_2], completeness=True)
     
-    # Split the query set by identifiers ("discipline/field/subfield") first.
-    query_sets_by_identifiers = giant_query_set.divide_by_keys([CATEGORY_KEY, CATEGORY_SUB_KEY_1, CATEGORY_SUB_KEY_2], completeness=True)
+    # Parsed in a worker thread, so that evaluations running alongside keep sending requests meanwhile
+    query_sets_by_identifiers = await asyncio.to_thread(load_subsets)
     # Add test mode prefix to output path and dir 
     if test_mode:
         preview_eval_counts(query_sets_by_identifiers)
@@ -57,15 +67,19 @@ async def conduct_supergpqa(supergpqa_file_path: str, worker: Worker, response_p
         score_output_path = os.path.join("test/", score_output_path)
 
     if subset_max_size > 0:
-        [query_sets_by_identifiers.update(
-            {identifier: subset[:subset_max_size]}
-            )
-         for identifier, subset in query_sets_by_identifiers.items()]
+        for identifier, subset in query_sets_by_identifiers.items():
+            # Slicing copies the query list into a new QuerySet. Skip the subsets already within the limit.
+            if len(subset) > subset_max_size:
+                query_sets_by_identifiers[identifier] = subset[:subset_max_size]
         
     id_query_set_pairs_sorted_in_alphabetical_order = sorted(list(query_sets_by_identifiers.items()), key=lambda tup: tup[0])
     if test_mode:
         id_query_set_pairs_sorted_in_alphabetical_order = id_query_set_pairs_sorted_in_alphabetical_order[:3]
+    # Only the subsets to evaluate stay referenced. The rest of the file, i.e. the rows cut by subset_max_size and the subsets skipped in test mode, is freed before the requests start.
+    del query_sets_by_identifiers
 
+    subset_semaphore = asyncio.Semaphore(max_concurrent_subsets) if max_concurrent_subsets > 0 else contextlib.nullcontext()
+    
     async def task(identifier: str, query_set: QuerySet):
         """
         1. Create temporary MCQ subset
@@ -76,43 +90,51 @@ async def conduct_supergpqa(supergpqa_file_path: str, worker: Worker, response_p
         
         4. Store responses by categories. 
         """
-        # Query structure: [
-        #     {... "question": ..., "options": [...], "answer": ..., ...}
-        # ]:
-        mcq_query_set = make_mcq_from_query_set(query_set, query_key=QUERY_KEY, options_key=OPTIONS_KEY)
-        response_set = await worker(mcq_query_set, query_key=QUERY_KEY).invoke(enable_metrics=enable_metrics)
-        score_summary = await response_set.judge(
-            answer_key=ANSWER_KEY,
-            eval_name=identifier,
-            response_preprocessor=response_preprocessor)
-        # Score has been annotated in each response object.
-        responses = response_set.get_responses()
+        async with subset_semaphore:
+            # Query structure: [
+            #     {... "question": ..., "options": [...], "answer": ..., ...}
+            # ]:
+            mcq_query_set = await asyncio.to_thread(make_mcq_from_query_set, query_set, query_key=QUERY_KEY, options_key=OPTIONS_KEY)
+            response_set = await worker(mcq_query_set, query_key=QUERY_KEY).invoke(enable_metrics=enable_metrics)
+            score_summary = await response_set.judge(
+                answer_key=ANSWER_KEY,
+                eval_name=identifier,
+                response_preprocessor=response_preprocessor)
+            # Score has been annotated in each response object.
+            responses = response_set.get_responses()
 
-        # Store the category.
-        ResponseSet(responses).store_to(
-                craft_category_path(
-                    results_dir,
-                    DATASET_NAME,
-                    MODEL,
-                    identifier,
-                    file_ext="jsonl")
-            )
+            # Store the category.
+            result_writer.put(
+                    craft_category_path(
+                        results_dir,
+                        DATASET_NAME,
+                        MODEL,
+                        identifier,
+                        file_ext="jsonl"),
+                    responses
+                )
         
-        # Calculate score for each identifier.
-        score_summary.update({
-            "dataset": DATASET_NAME,
-            "model": MODEL
-            })
-        if enable_metrics:
-            score_summary.update({"total_output_tokens": sum([query["output_tokens"] for query in response_set.get_responses()])})
-        ResponseSet([score_summary]).store_to(score_output_path)
+            # Calculate score for each identifier.
+            score_summary.update(SCORE_META)
+            if enable_metrics:
+                score_summary.update({"total_output_tokens": sum(query["output_tokens"] for query in response_set.get_responses()), "cache_hits": sum(query["cached"] for query in response_set.get_responses())})
+            await score_buffer.add(score_summary)
     
     tasks = []
     for identifier, query_set in id_query_set_pairs_sorted_in_alphabetical_order:
         tasks.append(task(identifier, query_set))
 
-    for completed_task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc=f"{DATASET_NAME}: Task Completion Progress", position=0):
-        await completed_task
+    # Result files are written in the background, so that a subset frees its slot as soon as it is judged
+    result_writer = ResultWriter()
+    score_buffer = ScoreBuffer(score_output_path, result_writer)
+    try:
+        await run_subset_tasks(tasks, desc=f"{DATASET_NAME}: Task Completion Progress")
+    finally:
+        try:
+            await result_writer.close()
+        finally:
+            # Keep the scores of finished subsets even if another subset failed
+            await score_buffer.flush()
     
     # Initialize a RESULTFILE in evaluation results directory.
     def log():
@@ -125,29 +147,9 @@ async def conduct_supergpqa(supergpqa_file_path: str, worker: Worker, response_p
         log_resultfile(DATASET_NAME, worker, eval_dir, params=params)
     log()
     
-def make_mcq_from_query_set(query_set: QuerySet, query_key:str, options_key: str):
-    """
-    Create a typical MCQ query set from mmlu pro dataset.
-    
-    Source: `[... "options": "[]"]`
-    
-    query_key will be overwritten by the new mcq query field. e.g. `Q? \\nA. Answer\\nB. Answer...`
-    """
-    new_queries = query_set.get_queries()
-    [query_obj.update(
-        {query_key: f"{query_obj[query_key]}\n"
-            + "\n".join(
-                [f"{LETTER}. {CONTENT}" for LETTER, CONTENT
-                    in zip(
-                    "ABCDEFGHIJKLMNOPQRSTUVWXYZ",
-                    query_obj[options_key])])}
-    ) for query_obj in new_queries]
-    new_query_set = QuerySet(new_queries)
-    new_query_set.file_path = query_set.get_path()
-    return new_query_set
-
 def craft_category_path(results_dir: str, dataset_name: str, model: str, category: str, file_ext):
-        return f"{strip_trailing_slashes_from_path(results_dir)}/{dataset_name}/{model}/{sanitize_pathname(f"{category}")}.{file_ext}"
+        # The directory part is shared by every category and memoized in craft_eval_dir_path
+        return f"{craft_eval_dir_path(results_dir, dataset_name, model)}/{sanitize_pathname(category)}.{file_ext}"
     
         
 def preview_eval_counts(query_sets_by_identifiers: dict[str, QuerySet]):
@@ -1,22 +1,128 @@
 from io_managers import get_reader, get_writer
 from text_preprocessors import as_is
-from judgers.presets import STRICT_MATCH, JUDGE_FAILED_MSG
-from request_manager.request_manager import FALLBACK_ERR_MSG
-from random import shuffle
+from judgers.presets import INLINE_JUDGERS, STRICT_MATCH, JUDGE_FAILED_MSG
+from request_manager.request_manager import EMPTY_QUERY_MSG, FALLBACK_ERR_MSG
+import numpy as np
 from typing import Any, Callable, Coroutine
 from collections import defaultdict
 import logging
 import dotenv
 import asyncio
+import concurrent.futures
 import copy
+import operator
 import os
+import threading
 import time
 
 dotenv.load_dotenv()
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 SCORING_BATCH_SIZE = int(os.getenv("SCORING_BATCH_SIZE", "5"))
+# How many files `astore_to` writes at the same time
+STORE_MAX_WORKERS = max(int(os.getenv("STORE_MAX_WORKERS") or 4), 1)
+
+# Shared by all `astore_to` calls, so that datasets with hundreds of subsets do not open hundreds of files at once
+_store_executor = concurrent.futures.ThreadPoolExecutor(max_workers=STORE_MAX_WORKERS, thread_name_prefix="store_to")
+
+def _make_merger(key_list_to_merge, with_key_names=True) -> Callable[[dict], str]:
+    """
+    Build the format template once, e.g. "Question: {}\nA: {}\nB: {}", and return a function filling it with the values of a query. See `QuerySet.merge_keys`.
+    """
+    escaped_key_names = [str(key).replace("{", "{{").replace("}", "}}") for key in key_list_to_merge]
+    template = "\n".join([f"{key}: {{}}" if with_key_names else "{}" for key in escaped_key_names])
+    # Fetch the values of each query with a single itemgetter call
+    get_values = operator.itemgetter(*key_list_to_merge)
+    if len(key_list_to_merge) == 1:
+        return lambda query: template.format(get_values(query))
+    return lambda query: template.format(*get_values(query))
+
+# Immutable leaf types of parsed data files, shared instead of copied
+_IMMUTABLE_TYPES = (str, int, float, bool, type(None))
+
+def _deepcopy_json_like(value):
+    """
+    Same result as `copy.deepcopy` for the dicts, lists and scalars of parsed data files, about 5x faster as it skips deepcopy's memo and dispatch. Unlike deepcopy, an object referenced twice is copied twice. Other types are handed to `copy.deepcopy`.
+    """
+    value_type = type(value)
+    if value_type is dict:
+        return {key: _deepcopy_json_like(item) for key, item in value.items()}
+    if value_type is list:
+        return [_deepcopy_json_like(item) for item in value]
+    if value_type in _IMMUTABLE_TYPES:
+        return value
+    return copy.deepcopy(value)
+
+# (score change, full score change) of a skipped question, see ResponseSet._judge_single_resp_obj
+_SKIPPED = (0, -1)
+
+def _try_preprocess(preprocessor: Callable[[str], str], value) -> str | None:
+    """
+    :return: The preprocessed value, None if the preprocessor raised. See `ResponseSet.judge`.
+    """
+    try:
+        return preprocessor(value)
+    except Exception as e:
+        # Preprocessing failed, skip the question.
+        logger.error(f"An error occurred in preprocessing stage: {str(e)[:50]}... Skip the question.")
+        return None
+
+# Generator methods hold the bit generator's lock, so subsets prepared in worker threads can share it
+_rng = np.random.default_rng()
+
+def _shuffle_options(queries: list[dict], answer_key, keys_to_shuffle, target_option_keys) -> tuple[list[list], list[str]]:
+    """
+    Shuffle the options of every query independently, with one (N, K) permutation matrix instead of a `random.shuffle` per query. See `QuerySet.mcq_shuffle`.
+    
+    :return: (the option values of each query in target_option_keys order, the new answer key of each query, "" if its answer is not one of keys_to_shuffle)
+    """
+    answer_indices = []
+    key_indices = {key: i for i, key in enumerate(keys_to_shuffle)}
+    for query_obj in queries:
+        try:
+            answer_indices.append(key_indices.get(query_obj[answer_key], -1))
+        except KeyError:
+            raise KeyError(f"Specified answer key not found. Query: {str(query_obj)[:50]}...; Available keys: {", ".join(query_obj.keys())}")
+    return _permute_options(queries, answer_indices, keys_to_shuffle, target_option_keys)
+
+def _permute_options(queries: list[dict], answer_indices: list[int], keys_to_shuffle, target_option_keys) -> tuple[list[list], list[str]]:
+    """
+    The permutation behind `_shuffle_options`, for datasets that locate the answer of each query themselves, e.g. gpqa where the correct option is always stored under the same key.
+    
+    :params list[int] answer_indices: The position of each query's answer in keys_to_shuffle, -1 if its answer is not an option
+    :return: Same as `_shuffle_options`
+    """
+    if not queries:
+        return [], []
+    # (N, K) option matrix, one row per query
+    options = np.array([[query_obj[key] for key in keys_to_shuffle] for query_obj in queries], dtype=object)
+    # An independent random permutation of the option columns for each row, drawn in a single call
+    permutations = _rng.permuted(np.tile(np.arange(options.shape[1]), (options.shape[0], 1)), axis=1)
+    shuffled_options = np.take_along_axis(options, permutations, axis=1)
+    # Where the answer landed. Rows whose answer is not an option point at the trailing "".
+    landed = permutations == np.array(answer_indices)[:, None]
+    answer_positions = np.where(landed.any(axis=1), np.argmax(landed, axis=1), len(target_option_keys))
+    new_answers = np.array([*target_option_keys, ""], dtype=object)[answer_positions]
+    return shuffled_options.tolist(), new_answers.tolist()
+
+# Writers read-modify-write their files. Writes to the same path, e.g. score_output_path from concurrent subsets, are serialized with one lock per path.
+_store_locks: defaultdict[str, threading.Lock] = defaultdict(threading.Lock)
+_store_locks_guard = threading.Lock()
+
+def _get_store_lock(file_path) -> threading.Lock:
+    with _store_locks_guard:
+        return _store_locks[os.path.abspath(file_path)]
+
+# Result directories created or found by store_to. Every category of a dataset is stored under the same directory.
+_known_dirs: set[str] = set()
+
+def _ensure_dir(dirname: str):
+    """
+    `os.makedirs(dirname, exist_ok=True)`, only once per directory.
+    """
+    if dirname != "" and dirname not in _known_dirs:
+        os.makedirs(dirname, exist_ok=True)
+        _known_dirs.add(dirname)
 
 class QuerySet:
 
@@ -33,17 +139,31 @@ class QuerySet:
     def _append(self, query: dict[str, Any]) -> None:
         self.queries.append(query)
 
-    def __init__(self, file_path_or_query_list: str | list[dict] | list[str], field_names=[]):
+    @classmethod
+    def _from_list(cls, queries: list[dict], file_path: str | None = None) -> 'QuerySet':
+        """
+        Wrap a query object list derived from another query set, e.g. a slice or a transformed copy, without going through the checks of `__init__`.
+        
+        :params list[dict] queries: Taken as is, not copied.
+        :params str file_path: The path of the query set it derives from.
+        """
+        query_set = cls.__new__(cls)
+        query_set.queries = queries
+        query_set.file_path = file_path
+        return query_set
+
+    def __init__(self, file_path_or_query_list: str | list[dict] | list[str], field_names=[], nrows=0):
         """
         Create a query set. After instantiation, the query set is read only.
         
         :params str | list[dict] | list[str] file_path_or_query_list: a data file path,  a query object list, or a query string list.
         :params field_names:  a list of field names to read from the file. If empty, all fields are read.
+        :params int nrows: Optional. Only read the first nrows queries from the file. 0 (default) = read all. csv files stop being parsed after nrows records.
         
         """
         if isinstance(file_path_or_query_list, str):
             # A path to the query file is provided
-            self.queries = self._read_queries_from_file(file_path_or_query_list, field_names)
+            self.queries = self._read_queries_from_file(file_path_or_query_list, field_names, nrows)
             self.file_path = file_path_or_query_list
         elif len(file_path_or_query_list) == 0:
             # The provided query list is empty
@@ -62,7 +182,7 @@ class QuerySet:
             self.file_path = None
             self.queries = [{"query": query} for query in file_path_or_query_list]
 
-    def _read_queries_from_file(self, file_path_or_query_list: str, field_names: list[str]):
+    def _read_queries_from_file(self, file_path_or_query_list: str, field_names: list[str], nrows=0):
         reader: Callable[[str, list], list] = None
         try:
             reader, ext = get_reader(file_path_or_query_list)
@@ -70,6 +190,11 @@ class QuerySet:
             raise ValueError(f"Reading from unsupported file format: \"{file_path_or_query_list}\".")
         
         # None safety has been ensured
+        if nrows > 0:
+            if ext in (".csv", ".jsonl"):
+                # csv and jsonl are parsed row by row, no need to read the rest of the file
+                return reader(file_path_or_query_list, field_names, nrows=nrows)
+            return reader(file_path_or_query_list, field_names)[:nrows]
         return reader(file_path_or_query_list, field_names)
         
     
@@ -82,9 +207,7 @@ class QuerySet:
             return self.queries[key]
         elif isinstance(key, slice):
             # Handle slicing
-            subset = QuerySet(self.queries[key])
-            subset.file_path = self.file_path
-            return subset
+            return QuerySet._from_list(self.queries[key], self.file_path)
         else:
             raise TypeError(f"Invalid key type: {type(key)}. Only int and slice are supported.")
     
@@ -94,19 +217,32 @@ class QuerySet:
         """
         return self.file_path
     
-    def get_queries(self):
+    def get_queries(self, deep=True):
         """
-        :return: a deepcopy of the query object list. Modifying this list does not affect the original query set.
+        :params bool deep: Default to True. False: copy the query dicts only, nested values e.g. option lists are shared with the original query set. Enough when only top-level keys are set.
+        :return: a copy of the query object list. Modifying this list (and with deep=False, the top-level keys of its dicts) does not affect the original query set.
 
         """
-        return copy.deepcopy(self.queries)
+        if not deep:
+            return [dict(query) for query in self.queries]
+        return _deepcopy_json_like(self.queries)
+    
+    def get_column(self, key) -> list:
+        """
+        Read one field of every query without copying the whole query set.
+        
+        :params key: The field to read.
+        :return: The values of the field, in query order. The list is new, the values are not copied.
+        """
+        return [query[key] for query in self.queries]
     
     def get_query_list(self, query_key="query"):
         """
         :return:  a list of query strings. Modifying this list does not affect the original query set.
 
         """
-        return [query[query_key] for query in self.get_queries()]
+        # Query strings are immutable, no need to deep copy the query objects
+        return self.get_column(query_key)
     
     def divide(self, division_size=10) -> list['QuerySet']:
         """
@@ -135,13 +271,24 @@ class QuerySet:
         :params bool completeness: in case any query object isn't complete with all division keys. e.g. with `division_keys=["category", "discipline"]` and `query={"category": "math"}`, True: Add the orphan query to the "unsorted" leaf of the "category" node. False: halt the division.
         :return: a flattened tree-shaped dict of distinct keys with query set objects on leaf nodes e.g. `{"math/algebra/abstract": QuerySet}`
         """
-        def create_default_query_set():
-            default_query_set = QuerySet([])
-            default_query_set.file_path=self.get_path()
-            return default_query_set
-        
-        all_queries_categorized = defaultdict(create_default_query_set)
+        # Group the query dicts in plain lists first, then wrap each group in a QuerySet once
+        queries_by_identifiers: dict[str, list[dict]] = {}
+        last_key_index = len(division_keys) - 1
+        # Fetch all division values of a complete query with a single itemgetter call
+        get_division_values = operator.itemgetter(*division_keys)
         for query in self.queries:
+            try:
+                division_values = get_division_values(query)
+            except KeyError:
+                division_values = None
+            if division_values is not None:
+                if last_key_index == 0:
+                    division_values = (division_values,)
+                if "unsorted" not in division_values:
+                    queries_by_identifiers.setdefault("/".join(division_values), []).append(query)
+                    continue
+            
+            # Incomplete query: walk the keys one by one
             identifiers = []
             for i, division_key in enumerate(division_keys):
                 division_value = query.get(division_key, "unsorted")
@@ -150,9 +297,12 @@ class QuerySet:
                 if key_not_found and completeness == False:
                     logger.error(f"Completeness is selected and specified key {division_key} is not found in the following query object. Division halted. \n{query}")
                     return
-                if key_not_found or i == len(division_keys) - 1:
-                    all_queries_categorized["/".join(identifiers)]._append(query)
+                if key_not_found or i == last_key_index:
+                    queries_by_identifiers.setdefault("/".join(identifiers), []).append(query)
         
+        all_queries_categorized = {}
+        for identifier, queries in queries_by_identifiers.items():
+            all_queries_categorized[identifier] = QuerySet._from_list(queries, self.get_path())
         return all_queries_categorized
     
     def merge_keys(self, key_list_to_merge, merged_key_name, with_key_names=True):
@@ -166,23 +316,17 @@ class QuerySet:
         :params with_key_names: whether to include key names in the merged field. e.g. `Field1: Value1\\nField2: Value2` vs `Value1\\nValue2`. Default to True.
 
         """
-        updated_query = self.get_queries()
-        
         # The query has been validated as non-empty. Safely retrieves the first element.
         # If specified key(s) does not exist in query, raise an exception.
         for key in key_list_to_merge:
-            if key not in updated_query[0]:
-                key_list_stringified = str(updated_query[0].keys())
+            if key not in self.queries[0]:
+                key_list_stringified = str(self.queries[0].keys())
                 raise KeyError(f"The specified key \"{key}\" not found in the query set.  Available keys: {key_list_stringified}")
                 
-        for query in updated_query:
-            merged_value = "\n".join([
-                f"{key}: {query[key]}" if with_key_names else f"{query[key]}"
-                for key in key_list_to_merge])
-            query[merged_key_name] = merged_value
-        updated_query_set = QuerySet(updated_query)
-        updated_query_set.file_path = self.file_path
-        return updated_query_set
+        merge = _make_merger(key_list_to_merge, with_key_names)
+        # Only a new key is added to each query. Copy and extend each query dict in a single pass instead of deep copying all values.
+        updated_query = [{**query, merged_key_name: merge(query)} for query in self.queries]
+        return QuerySet._from_list(updated_query, self.file_path)
     
     def flatten_field(self, field_to_flatten, new_field_names=[]):
         """
@@ -234,9 +378,7 @@ class QuerySet:
             
             flattened_queries.append(flattened_query)
         
-        flattened_set = QuerySet(flattened_queries)
-        flattened_set.file_path = self.file_path
-        return flattened_set
+        return QuerySet._from_list(flattened_queries, self.file_path)
     
     
     def mcq_shuffle(self, answer_key, target_answer_key, keys_to_shuffle=["A", "B", "C", "D"], target_option_keys=["A", "B", "C", "D"]):
@@ -250,42 +392,54 @@ class QuerySet:
         :return: A `QuerySet` object with shuffled keys.
         """
         
-        existing_queries = self.get_queries()
-        shuffled_queries = []
+        # Only top-level keys are replaced
+        existing_queries = self.get_queries(deep=False)
         if len(keys_to_shuffle) != len(target_option_keys):
             raise ValueError(f"The key lists before and after shuffling do not match in number. I can't shuffle {len(keys_to_shuffle)} options into {len(target_option_keys)}.")
-            
-        for query_obj in existing_queries:
-            answer=""
-            try:
-                answer=query_obj[answer_key]
-            except KeyError:
-                raise KeyError(f"Specified answer key not found. Query: {str(query_obj)[:50]}...; Available keys: {", ".join(query_obj.keys())}")
-            
-            shuffle(keys_to_shuffle)
-            new_query_obj = {}
-            new_answer = ""
-            # [A, B, C, D], [B, C, D, A] => {A: ..., B: ..., ...} 
-            for target_option_key, original_option_key in zip(target_option_keys, keys_to_shuffle):
-                # {A: some option}
-                new_query_obj[target_option_key]=query_obj[original_option_key]
-                # original option key is the answer 
-                if original_option_key == answer:
-                    # {answer: some option}
-                    new_answer = target_option_key
-            
+        
+        shuffled_options, new_answers = _shuffle_options(existing_queries, answer_key, keys_to_shuffle, target_option_keys)
+        # Update the shuffled options to existing queries, to keep other existing fields.
+        # [A, B, C, D], [B, C, D, A] => {A: ..., B: ..., ...} 
+        for query_obj, shuffled_row, new_answer in zip(existing_queries, shuffled_options, new_answers):
+            query_obj.update(zip(target_option_keys, shuffled_row))
             # To keep the order of target keys, update the answer key at last.
-            new_query_obj[target_answer_key]=new_answer
-            # The new query key has been populated
-            shuffled_queries.append(new_query_obj)
-            
-        # As per now, we have a new list of query objects.
-        # We will finish by updating the shuffled queries to existing queries, to keep other existing fields.
-        [existing_query.update(shuffled_query) for existing_query, shuffled_query in zip(existing_queries, shuffled_queries)]
+            query_obj[target_answer_key] = new_answer
+        
+        return QuerySet._from_list(existing_queries, self.get_path())
+    
+    def shuffled_merge(self, answer_key, target_answer_key, query_key, merged_key_name, keys_to_shuffle=["A", "B", "C", "D"], target_option_keys=["A", "B", "C", "D"], with_key_names=True):
+        """
+        Same as `mcq_shuffle(answer_key, target_answer_key, keys_to_shuffle, target_option_keys)` followed by `merge_keys([query_key, *target_option_keys], merged_key_name, with_key_names)`, in a single pass over the queries. The original QuerySet remains unchanged.
+        
+        :params answer_key: The answer key before shuffling
+        :params target_answer_key: Where to store the new answer after shuffling
+        :params query_key: The question field, merged before the shuffled options
+        :params merged_key_name: the name of the merged key. If the key already exists, it will be overwritten.
+        :params keys_to_shuffle: The mcq option keys to shuffle. Must match target_option_keys in number.
+        :params target_option_keys: Where to store the shuffled options. The order is preserved in the merged field.
+        :params with_key_names: whether to include key names in the merged field. Default to True.
+        :return: A `QuerySet` object with shuffled and merged keys.
+        """
+        if len(keys_to_shuffle) != len(target_option_keys):
+            raise ValueError(f"The key lists before and after shuffling do not match in number. I can't shuffle {len(keys_to_shuffle)} options into {len(target_option_keys)}.")
         
-        shuffled_set = QuerySet(existing_queries)
-        shuffled_set.file_path = self.get_path()
-        return shuffled_set
+        if self.queries:
+            for key in [query_key, *keys_to_shuffle]:
+                if key not in self.queries[0]:
+                    raise KeyError(f"The specified key \"{key}\" not found in the query set.  Available keys: {str(self.queries[0].keys())}")
+        
+        merge = _make_merger([query_key, *target_option_keys], with_key_names)
+        shuffled_options, new_answers = _shuffle_options(self.queries, answer_key, keys_to_shuffle, target_option_keys)
+        merged_queries = []
+        for query_obj, shuffled_row, new_answer in zip(self.queries, shuffled_options, new_answers):
+            # Only top-level keys are replaced. Copy the query dict instead of deep copying all values.
+            new_query_obj = dict(query_obj)
+            new_query_obj.update(zip(target_option_keys, shuffled_row))
+            new_query_obj[target_answer_key] = new_answer
+            new_query_obj[merged_key_name] = merge(new_query_obj)
+            merged_queries.append(new_query_obj)
+        
+        return QuerySet._from_list(merged_queries, self.get_path())
     
 class ResponseSet:
     def __init__(self, response_list: list[dict], query_key=None, response_key=None):
@@ -328,11 +482,30 @@ class ResponseSet:
     def get_query_key(self):
         return self.query_key
     
-    async def judge(self, answer_key="answer", context_key=None, eval_name="Evaluation", response_preprocessor=as_is, answer_preprocessor=as_is, judger=STRICT_MATCH, foreign_response_key=None):
+    def get_column(self, key) -> list:
+        """
+        :params key: The field to read from every response object.
+        :return: The values of the field, in response order.
+        """
+        return [resp_obj[key] for resp_obj in self.responses]
+    
+    def set_column(self, key, values: list):
+        """
+        Set a field on every response object in place, e.g. to aggregate another worker's responses to the same queries.
+        
+        :params key: The field to set.
+        :params values: One value per response object, in response order.
+        """
+        if len(values) != len(self.responses):
+            raise ValueError(f"Column length {len(values)} does not match response count {len(self.responses)}.")
+        for resp_obj, value in zip(self.responses, values):
+            resp_obj[key] = value
+    
+    async def judge(self, answer_key="answer", context_key=None, eval_name="Evaluation", response_preprocessor=as_is, answer_preprocessor=as_is, judger=STRICT_MATCH, foreign_response_key=None, score_key="score", judged_content_key="judged_content"):
         """
         Submit a [0,1] acc score judging task using specified answer field with optional context, preprocessing and judger method. Failed judgings are ignored. Return a scoring dictionary. On invalid judge parameters, returns None.
         
-        - :side effects: Modifies self.responses by adding a new field "score"
+        - :side effects: Modifies self.responses by adding new fields "score" and "judged_content" (see score_key and judged_content_key)
         
         :params answer_key: Specify the field name for answer. Default to "answer"
         :params str context_key: Optional. Specify the field name for context. Default to None. If left as None, context_key will fall back to query_key. If query_key is not specified, context_key will be ignored.
@@ -348,6 +521,8 @@ class ResponseSet:
           - Takes two strings and an optional context string (for model scoring). Output a [0,1] accuracy score (model scoring may return a JUDGE_FAILED_MSG: str). Default to STRICT_MATCH.
           
         :params str foreign_response_key: Default to None. Retrieve specified key value instead of the response_key set on instantiation. Default to None.
+        :params str score_key: The field to store each score in. Default to "score". Concurrent judges on the same response set must use different keys.
+        :params str judged_content_key: The field to store each preprocessed response in. Default to "judged_content".
 
         :return dict<str, Any>: A score dictionary with following fields:
 
@@ -376,9 +551,24 @@ class ResponseSet:
         
         semaphore = None if SCORING_BATCH_SIZE == 0 else asyncio.Semaphore(SCORING_BATCH_SIZE)
         
-        for resp_obj in self.responses:
-            # Receives a score delta tuple.
-            score_change, full_score_change = await self._judge_single_resp_obj(resp_obj, response_key, answer_key, context_key, response_preprocessor, answer_preprocessor, judger, semaphore)
+        # Preprocess the whole response set in one pass before judging. The pass runs in a worker thread, so that other subsets keep sending requests meanwhile.
+        preprocessed_pairs = await asyncio.to_thread(self._preprocess_all, response_key, answer_key, response_preprocessor, answer_preprocessor)
+        
+        inline_judger = INLINE_JUDGERS.get(judger)
+        if inline_judger is not None:
+            # e.g. STRICT_MATCH: a plain comparison. Judge the responses one after another on the event loop.
+            async def judge_inline(answer, response, context=""):
+                return inline_judger(answer, response, context=context)
+            
+            score_changes = [await self._judge_single_resp_obj(resp_obj, response_key, answer_key, context_key, preprocessed_response, preprocessed_answer, judge_inline, score_key=score_key, judged_content_key=judged_content_key)
+                             for resp_obj, (preprocessed_response, preprocessed_answer) in zip(self.responses, preprocessed_pairs)]
+        else:
+            # e.g. MODEL_SCORING: judge the responses concurrently, at most SCORING_BATCH_SIZE at a time
+            score_changes = await asyncio.gather(*(self._judge_single_resp_obj(resp_obj, response_key, answer_key, context_key, preprocessed_response, preprocessed_answer, judger, semaphore, score_key=score_key, judged_content_key=judged_content_key)
+                                                   for resp_obj, (preprocessed_response, preprocessed_answer) in zip(self.responses, preprocessed_pairs)))
+        
+        # Receives score delta tuples.
+        for score_change, full_score_change in score_changes:
             score += score_change
             full_score += full_score_change
                 
@@ -388,6 +578,8 @@ class ResponseSet:
         return {"eval_name": eval_name, "score": score, "full_score": full_score, "accuracy": score/full_score}
 
     def _validate_key_names(self, eval_name, answer_key, context_key, foreign_response_key):
+        # Fields are checked on the first response object. `in` looks up the dict keys directly.
+        first_resp_obj = self.responses[0]
         
         if foreign_response_key and not isinstance(foreign_response_key, str):
             logger.error(f"foreign_response_key must be a string. Got {type(foreign_response_key)} instead. ")
@@ -399,67 +591,59 @@ class ResponseSet:
             logger.error(f"The evaluation {eval_name} does not have response_key specified. Unable to proceed with score judging.")
             return False
             
-        if response_key not in list(self.responses[0].keys()):
+        if response_key not in first_resp_obj:
             logger.error(f"Evaluation {eval_name}'s response_key {response_key} does not seem to be an existing field.")
             return False
                 
-        if answer_key not in list(self.responses[0].keys()):
+        if answer_key not in first_resp_obj:
             logger.error(f"Evaluation {eval_name}'s answer_key {answer_key} does not seem to be an existing field.")
             return False
         
         # If context_key is specified, need to check whether it exists in the response set.
         # If not, validation fails
         if context_key is not None:
-            if context_key not in list(self.responses[0].keys()):
+            if context_key not in first_resp_obj:
                 logger.error(f"Evaluation {eval_name}'s optional context_key {context_key} does not seem to be an existing field.")
                 return False
         
         return True
     
-    async def _judge_single_resp_obj(self, resp_obj, response_key, answer_key, context_key, response_preprocessor: Callable[[str], str], answer_preprocessor: Callable[[str], str], judger: Callable[[str, str, str], Coroutine[Any, Any, float | str]], semaphore=None):
-        response = resp_obj[response_key]
-        correct_answer = resp_obj[answer_key]
-        # context_key has been validated to be either 1) an existing key in response 2) fallback to query_key or 3) None. Ensure None safety before retrieval
-        context = resp_obj[context_key] if context_key else ""
-                
-        # Detect cases where questions should be skipped
-        def _is_skipped_pre_judging():
-            # Detect failed request fallback message and skip the question
-            if response == FALLBACK_ERR_MSG:
-                return True
-            
-            # For each question, do preprocessings first.
-            try:
-                preprocessed_response = response_preprocessor(response)
-                preprocessed_answer = answer_preprocessor(correct_answer)
-            except Exception:
-                # Preprocessing failed, skip the question.
-                logger.error(f"An error occurred in preprocessing stage: {str(Exception)[:50]}... Skip the question.")
-                return True
-
-            # Skip questions with empty answer/response.
-            if preprocessed_answer == "":
-                # No valid answer field. Skip the question.
-                logger.error(f"Unrecognizable answer. Skipped. Response: {resp_obj[response_key][:50]}... ; Answer: {resp_obj[answer_key][:50]}...")
-                return True
-            
-            if preprocessed_response == "":
-                # No valid response field to judge. Skip the question.
-                logger.error(f"Unrecognizable response. Skipped. Response: {resp_obj[response_key][:50]}... ; Answer: {resp_obj[answer_key][:50]}...")
-                return True
+    def _preprocess_all(self, response_key, answer_key, response_preprocessor: Callable[[str], str], answer_preprocessor: Callable[[str], str]) -> list[tuple[str | None, str | None]]:
+        """
+        Preprocess the response and answer of every response object. Failed requests and skipped empty queries are not preprocessed.
         
+        :return: (preprocessed response, preprocessed answer) of each response object. None if it is not preprocessed or its preprocessing failed.
+        """
+        judged_indices = [i for i, resp_obj in enumerate(self.responses) if resp_obj[response_key] not in (FALLBACK_ERR_MSG, EMPTY_QUERY_MSG)]
+        responses = [self.responses[i][response_key] for i in judged_indices]
+        
+        preprocessed_responses = [_try_preprocess(response_preprocessor, response) for response in responses]
+        
+        preprocessed_pairs = [(None, None)] * len(self.responses)
+        for i, preprocessed_response in zip(judged_indices, preprocessed_responses):
+            preprocessed_pairs[i] = (preprocessed_response, _try_preprocess(answer_preprocessor, self.responses[i][answer_key]))
+        return preprocessed_pairs
+    
+    async def _judge_single_resp_obj(self, resp_obj, response_key, answer_key, context_key, preprocessed_response: str | None, preprocessed_answer: str | None, judger: Callable[[str, str, str], Coroutine[Any, Any, float | str]], semaphore=None, score_key="score", judged_content_key="judged_content"):
         # Tuple[score, full_score] for score changes. (0, -1) for skipped; (score, 0) for not skipped
-        SKIPPED = (0, -1)
-        def JUDGED(result_score):
-            return (result_score,  0)
+        # Failed request fallback message (or a skipped empty query), or preprocessing failed. See _preprocess_all
+        if preprocessed_response is None or preprocessed_answer is None:
+            return _SKIPPED
+
+        # Skip questions with empty answer/response.
+        if preprocessed_answer == "":
+            # No valid answer field. Skip the question.
+            logger.error(f"Unrecognizable answer. Skipped. Response: {resp_obj[response_key][:50]}... ; Answer: {resp_obj[answer_key][:50]}...")
+            return _SKIPPED
         
-        if  _is_skipped_pre_judging():
-            # Tuple[score, full_score] for score changes
-            return SKIPPED
+        if preprocessed_response == "":
+            # No valid response field to judge. Skip the question.
+            logger.error(f"Unrecognizable response. Skipped. Response: {resp_obj[response_key][:50]}... ; Answer: {resp_obj[answer_key][:50]}...")
+            return _SKIPPED
+        
+        # context_key has been validated to be either 1) an existing key in response 2) fallback to query_key or 3) None. Ensure None safety before retrieval
+        context = resp_obj[context_key] if context_key else ""
 
-        # Preprocessors have been validated.
-        preprocessed_response = response_preprocessor(response)
-        preprocessed_answer = answer_preprocessor(correct_answer)
         # Score judging algorithm.
         if semaphore:
             async with semaphore:
@@ -471,13 +655,11 @@ class ResponseSet:
             # Score judging failed. Most likely stemming from model scoring.
             logger.error(f"Score judging failed. Skipped. Response: {resp_obj[response_key][:50]}... ; Answer: {resp_obj[answer_key][:50]}...")
             # Skip the question in scoring
-            return SKIPPED
+            return _SKIPPED
         
-        resp_obj.update({
-            "judged_content": preprocessed_response,
-            "score": score
-            })
-        return JUDGED(score)
+        resp_obj[judged_content_key] = preprocessed_response
+        resp_obj[score_key] = score
+        return (score, 0)
 
     
     def store_to(self, file_path):
@@ -488,12 +670,10 @@ class ResponseSet:
 
         """
         writer, ext = get_writer(file_path)
-        if ext == None:
+        if ext is None:
             raise ValueError(f"Storing to unsupported file format: \"{file_path}\". Please use csv, xlsx or jsonl.")
         
         dirname = os.path.dirname(file_path)
-        if dirname != "" and not os.path.isdir(dirname):
-            os.makedirs(dirname)
             
         # Handle concurrent file writing between jobs. Default: 2 retries, 5 sec interval
         max_retries = 2 # set max retry count
@@ -502,12 +682,26 @@ class ResponseSet:
         
         for _ in range(max_retries + 1): # range has exclusive upper bound
             try:
-                writer(file_path, self.responses)
+                _ensure_dir(dirname)
+                with _get_store_lock(file_path):
+                    writer(file_path, self.responses)
                 break
             except IOError:
+                # e.g. the directory was removed meanwhile. Look it up again on retry.
+                _known_dirs.discard(dirname)
                 if retry < max_retries:
                     retry += 1
                     logger.error(f"Failed to store response results to {file_path}. Retry {retry}/{max_retries} in {interval} second(s)...")
                     time.sleep(interval)
                 else:
                     raise IOError(f"Failed to store response results to {file_path} after {max_retries} retries.")
+    
+    async def astore_to(self, file_path):
+        """
+        Same as `store_to`, but the write runs in a worker thread so that the event loop keeps serving other requests meanwhile. Use it inside coroutines.
+        
+        At most STORE_MAX_WORKERS (.env file, default 4) writes run at the same time. The others wait for a free thread.
+        
+        :params file_path: The path to store the results. Support CSV, XLSX and JSONL format.
+        """
+        await asyncio.get_running_loop().run_in_executor(_store_executor, self.store_to, file_path)
@@ -1,15 +1,16 @@
-from io_managers.csv_manager import read_from_csv, store_to_csv
-from io_managers.jsonl_manager import read_from_jsonl, store_to_jsonl
+from io_managers.csv_manager import iter_from_csv, read_from_csv, store_to_csv
+from io_managers.jsonl_manager import iter_from_jsonl, read_from_jsonl, store_to_jsonl
 from io_managers.xlsx_manager import read_from_excel, store_to_excel
 from io_managers.raw_file_writer import write_to_file as store_to_raw
 from io_managers.json_manager import read_from_json, store_to_json
+from io_managers.parquet_manager import read_from_parquet, store_to_parquet
 
 from typing import Callable
 import os
 
 def get_reader(file_path:str) -> tuple[Callable[[str, list], list], str]:
     """
-    Get reader for structured data file. Supported file format: .csv/.xlsx/.jsonl
+    Get reader for structured data file. Supported file format: .csv/.xlsx/.jsonl/.json/.parquet (with pyarrow)
     
     :params str file_path: `path/to/the/file/to/read.ext`
     :raise: ValueError on unsupported format (How am I supposed to read that?)
@@ -19,18 +20,19 @@ def get_reader(file_path:str) -> tuple[Callable[[str, list], list], str]:
         ".csv": read_from_csv,
         ".xlsx": read_from_excel,
         ".jsonl": read_from_jsonl,
-        ".json": read_from_json
+        ".json": read_from_json,
+        ".parquet": read_from_parquet
     }
     
     ext = os.path.splitext(file_path)[1]
     reader = file_readers.get(ext)
     if reader == None:
-        raise ValueError(f"I do not know how to read from a \"{file_path}\" file. Please use the following formats: csv, xlsx, jsonl.")
+        raise ValueError(f"I do not know how to read from a \"{file_path}\" file. Please use the following formats: csv, xlsx, jsonl, json, parquet.")
     return (reader, ext)
     
 def get_writer(file_path: str) -> tuple[Callable[[str, list], None], str]:
     """
-    Get writer based on file extension. Structured formats with dedicated writer: .csv/.xlsx/.jsonl
+    Get writer based on file extension. Structured formats with dedicated writer: .csv/.xlsx/.jsonl/.json/.parquet (with pyarrow)
     
     If unknown extension is encountered, get a writer in plain text (preserving the specified extension).
     
@@ -43,7 +45,8 @@ def get_writer(file_path: str) -> tuple[Callable[[str, list], None], str]:
         ".csv": store_to_csv,
         ".xlsx": store_to_excel,
         ".jsonl": store_to_jsonl,
-        ".json": store_to_json
+        ".json": store_to_json,
+        ".parquet": store_to_parquet
     }
     ext = os.path.splitext(file_path)[1]
     writer = file_writers.get(ext)
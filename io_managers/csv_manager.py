@@ -1,8 +1,25 @@
 import csv
+import itertools
 import os
+import logging
+
+try:
+    import pyarrow
+    import pyarrow.csv
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# Large write buffer so that big result sets are flushed in a few write() calls
+WRITE_BUFFER_SIZE = 1 << 20
+# New csv files with more rows than this are written by pyarrow if it is installed
+PYARROW_MIN_ROWS = 1000
 
 def store_to_csv(filename: str, data_list: list[dict]):
     """
+    Append entries to a csv file. If the entries bring new fields, the file is rewritten with the merged header; otherwise rows are appended without reading the file.
+    
     :params filename: path to the csv file
     :params list[dict] data_list: list of dictionaries to be written to the csv file
     :return: None
@@ -11,57 +28,116 @@ def store_to_csv(filename: str, data_list: list[dict]):
         return
     
     existing_data = []
-    fieldnames = []
+    # dict as an ordered set
+    fieldnames = {}
     
-    # Read existing entries from the file if it exists
     if os.path.exists(filename):
+        # Fast path: the existing header already covers every new key, append the rows
+        with open(filename, 'r', newline='', encoding="utf-8") as csvfile:
+            header_line = csvfile.readline()
+        existing_fieldnames = next(csv.reader([header_line]), [])
+        if existing_fieldnames and _covers_keys(existing_fieldnames, data_list):
+            with open(filename, 'a', newline='', encoding="utf-8", buffering=WRITE_BUFFER_SIZE) as csvfile:
+                writer = csv.DictWriter(csvfile, fieldnames=existing_fieldnames, quoting=_append_quoting(header_line, existing_fieldnames))
+                writer.writerows(data_list)
+            return
+
+        # Read existing entries from the file to rewrite it with the merged header
         with open(filename, 'r', encoding="utf-8") as csvfile:
             reader = csv.DictReader(csvfile)
             existing_data = list(reader)
-            fieldnames = reader.fieldnames or []
+            fieldnames = dict.fromkeys(reader.fieldnames or [])
 
     # Merge existing data with new data
     merged_data = existing_data + data_list
 
     # Update fieldnames with new keys while preserving order
     for entry in data_list:
-        for key in entry.keys():
-            if key not in fieldnames:
-                fieldnames.append(key)
+        fieldnames.update(dict.fromkeys(entry))
+    
+    # Large new file: let pyarrow's C++ writer do the quoting
+    if not existing_data and len(data_list) > PYARROW_MIN_ROWS and _store_with_pyarrow(filename, list(fieldnames), data_list):
+        return
     
     # IO
-    with open(filename, 'w', newline='', encoding="utf-8") as csvfile:
+    with open(filename, 'w', newline='', encoding="utf-8", buffering=WRITE_BUFFER_SIZE) as csvfile:
         writer = csv.DictWriter(csvfile, fieldnames=list(fieldnames))
         writer.writeheader()
         writer.writerows(merged_data)
 
-def read_from_csv(filename: str, fields=[]):
+def _store_with_pyarrow(filename: str, fieldnames: list[str], data_list: list[dict]) -> bool:
+    """
+    Write a new csv file with pyarrow. Values are stringified the way csv.DictWriter does (None and missing keys become empty cells).
+    
+    :return bool: False if pyarrow is not installed or failed, in which case nothing is written
+    """
+    if pyarrow is None:
+        return False
+    try:
+        columns = {
+            field: [None if (value := entry.get(field)) is None else str(value) for entry in data_list]
+            for field in fieldnames
+        }
+        table = pyarrow.table(columns, schema=pyarrow.schema([(field, pyarrow.string()) for field in fieldnames]))
+        # Same line endings as csv.DictWriter. Strings are always quoted, see `_append_quoting`.
+        pyarrow.csv.write_csv(table, filename, pyarrow.csv.WriteOptions(eol="\r\n"))
+        return True
+    except (pyarrow.ArrowException, ValueError, OSError) as e:
+        logger.warning("pyarrow failed to write %s, falling back to csv module: %s", filename, e)
+        if os.path.exists(filename):
+            os.remove(filename)
+        return False
+
+def _append_quoting(header_line: str, fieldnames: list[str]) -> int:
     """
+    pyarrow quotes every non-null value, header included, while csv.DictWriter only quotes the values that need it. Append to a file in the quoting it was written with.
+    
+    :return int: csv.QUOTE_NOTNULL for a file written by pyarrow, csv.QUOTE_MINIMAL otherwise
+    """
+    quoted_header = ",".join(f'"{field.replace('"', '""')}"' for field in fieldnames)
+    if header_line.rstrip("\r\n") == quoted_header:
+        return csv.QUOTE_NOTNULL
+    return csv.QUOTE_MINIMAL
+
+def _covers_keys(fieldnames: list[str], data_list: list[dict]) -> bool:
+    known = set(fieldnames)
+    return all(known.issuperset(entry) for entry in data_list)
+
+def iter_from_csv(filename: str, fields=[]):
+    """
+    Iterate over the rows of a csv file without loading all of them at once.
+    
     :params filename: path to the csv file
     :params list[str] fields: list of fields to read. If empty, all fields are read
-    :return list[dict]:
-    :raise ValueError: if no record is read from the file
+    :return Iterator[dict]:
     :raise FileNotFoundError: if the file is not found
-
     """
-    data_list = []
     try:
         with open(filename, 'r', encoding="utf-8") as csvfile:
             reader = csv.DictReader(csvfile)
             if len(fields) == 0:
-                # Unspecified fields, read all fields
-                for row in reader:
-                    data_list.append(dict(row))  # Convert OrderedDict to regular dict
+                # Unspecified fields, read all fields. DictReader already yields plain dicts.
+                yield from reader
             else:
                 # Read only the specified fields
-                header_fields = reader.fieldnames
+                header_fields = reader.fieldnames or []
+                wanted = [field for field in fields if field in header_fields]
                 for row in reader:
-                    filtered_row = {field: row.get(field, "") for field in fields if field in header_fields}
-                    data_list.append(filtered_row)
-        
-        if len(data_list) == 0:
-            raise ValueError(f"No available field is found in \"{filename}\". It's likely empty or not containing the fields specified.")
-        
-        return data_list
+                    yield {field: row[field] for field in wanted}
     except FileNotFoundError:
         raise FileNotFoundError(f"File \"{filename}\" not found. You are likely to read from a non-existent file.")
+
+def read_from_csv(filename: str, fields=[], nrows=0):
+    """
+    :params filename: path to the csv file
+    :params list[str] fields: list of fields to read. If empty, all fields are read
+    :params int nrows: Optional. Stop reading after the first nrows records. 0 (default) = read all
+    :return list[dict]:
+    :raise ValueError: if no record is read from the file
+    :raise FileNotFoundError: if the file is not found
+
+    """
+    data_list = list(itertools.islice(iter_from_csv(filename, fields), nrows or None))
+    if len(data_list) == 0:
+        raise ValueError(f"No available field is found in \"{filename}\". It's likely empty or not containing the fields specified.")
+    return data_list
\ No newline at end of file
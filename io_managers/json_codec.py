@@ -0,0 +1,29 @@
+"""
+JSON encoding/decoding with orjson when it is installed (`pip install orjson`), falling back to the stdlib json module otherwise.
+
+`dumps` always returns utf-8 encoded bytes, `loads` accepts bytes or str.
+"""
+try:
+    import orjson
+
+    JSONDecodeError = orjson.JSONDecodeError
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+
+    def loads(data: bytes | str):
+        return orjson.loads(data)
+
+except ImportError:
+    import json
+
+    JSONDecodeError = json.JSONDecodeError
+
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+    def loads(data: bytes | str):
+        # Responses are utf-8. Decode directly instead of letting json detect the encoding.
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode("utf-8")
+        return json.loads(data)
@@ -1,6 +1,22 @@
+import itertools
 import json
 import os
-from typing import List, Dict
+from typing import Iterator, List, Dict
+from io_managers import json_codec
+
+def _encode_line(item: Dict) -> bytes:
+    try:
+        return json_codec.dumps(item) + b'\n'
+    except TypeError:
+        # e.g. non-str keys, which orjson refuses
+        return (json.dumps(item, ensure_ascii=False) + '\n').encode('utf-8')
+
+def _decode_line(line: bytes):
+    try:
+        return json_codec.loads(line)
+    except json_codec.JSONDecodeError:
+        # e.g. NaN, which json writes but orjson refuses
+        return json.loads(line)
 
 def store_to_jsonl(filename: str, data_list: List[Dict]):
     """
@@ -13,41 +29,53 @@ def store_to_jsonl(filename: str, data_list: List[Dict]):
     if not data_list:
         return
 
-    with open(filename, 'a', encoding='utf-8') as jsonl_file:
-        for item in data_list:
-            json.dump(item, jsonl_file, ensure_ascii=False)
-            jsonl_file.write('\n')
+    # Encode each object in one call (orjson if installed, see json_codec) and append the utf-8 lines in a single write
+    lines = [_encode_line(item) for item in data_list]
+    with open(filename, 'ab') as jsonl_file:
+        jsonl_file.writelines(lines)
 
-def read_from_jsonl(filename: str, fields: List[str] = []) -> List[Dict]:
+def iter_from_jsonl(filename: str, fields: List[str] = []) -> Iterator[Dict]:
     """
-    Read data from a JSONL file.
+    Iterate over the objects of a JSONL file line by line, without loading the whole file.
 
     :params str filename: Path to the JSONL file.
     :params list[str] fields: List of fields to read. If empty, all fields are read.
-    :return List[Dict]: A list of dictionaries, where each dictionary represents a JSON object from the file.
-    :raise ValueError: If no data is found for the specified fields or the file is empty.
+    :return Iterator[Dict]:
     :raise FileNotFoundError: If the file doesn't exist.
     """
     if not os.path.exists(filename):
         raise FileNotFoundError(f"File \"{filename}\" not found. You are likely to read from a non-existent file.")
-    data_list = []
-    with open(filename, 'r', encoding='utf-8') as jsonl_file:
+    # Lines are parsed from utf-8 bytes, without decoding them to str first
+    with open(filename, 'rb') as jsonl_file:
         for line in jsonl_file:
             line = line.strip()
             if line:
                 try:
-                    json_object = json.loads(line)
-                    if len(fields) == 0:
-                        # Unspecified fields, read all fields
-                        data_list.append(json_object)
-                    else:
-                        # Read only the specified fields
-                        filtered_object = {field: json_object.get(field, "") for field in fields if field in json_object}
-                        if filtered_object:
-                            data_list.append(filtered_object)
+                    json_object = _decode_line(line)
                 except json.JSONDecodeError:
                     # Skip invalid JSON lines
                     continue
+                if len(fields) == 0:
+                    # Unspecified fields, read all fields
+                    yield json_object
+                else:
+                    # Read only the specified fields
+                    filtered_object = {field: json_object.get(field, "") for field in fields if field in json_object}
+                    if filtered_object:
+                        yield filtered_object
+
+def read_from_jsonl(filename: str, fields: List[str] = [], nrows: int = 0) -> List[Dict]:
+    """
+    Read data from a JSONL file.
+
+    :params str filename: Path to the JSONL file.
+    :params list[str] fields: List of fields to read. If empty, all fields are read.
+    :params int nrows: Optional. Stop reading after the first nrows records. 0 (default) = read all
+    :return List[Dict]: A list of dictionaries, where each dictionary represents a JSON object from the file.
+    :raise ValueError: If no data is found for the specified fields or the file is empty.
+    :raise FileNotFoundError: If the file doesn't exist.
+    """
+    data_list = list(itertools.islice(iter_from_jsonl(filename, fields), nrows or None))
 
     if len(data_list) == 0:
         raise ValueError(f"No data found for any specified field(s): \"{fields}\". Either the file \"{filename}\" is empty or none of the field(s) exist.")
@@ -0,0 +1,63 @@
+import logging
+import os
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+def _require_pyarrow():
+    if pyarrow is None:
+        raise ImportError("Reading or writing parquet files requires pyarrow. Install it with `pip install pyarrow`.")
+
+def _to_table(data_list: list[dict]):
+    """
+    Build a table from the entries, keeping their value types. Columns mixing types (e.g. a score that is sometimes a string) are stored as strings, the way the csv writer does.
+    """
+    try:
+        return pyarrow.Table.from_pylist(data_list)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        fieldnames = list(dict.fromkeys(key for entry in data_list for key in entry))
+        columns = {
+            field: [None if (value := entry.get(field)) is None else str(value) for entry in data_list]
+            for field in fieldnames
+        }
+        return pyarrow.table(columns, schema=pyarrow.schema([(field, pyarrow.string()) for field in fieldnames]))
+
+def store_to_parquet(filename: str, data_list: list[dict]):
+    """
+    Append entries to a parquet file. A parquet file cannot be appended in place, so an existing file is read and rewritten together with the new entries, with their fields merged. Requires pyarrow.
+    
+    :params filename: path to the parquet file
+    :params list[dict] data_list: list of dictionaries to be written to the file
+    :return: None
+    """
+    if not data_list:
+        return
+    _require_pyarrow()
+    if os.path.exists(filename):
+        data_list = pyarrow.parquet.read_table(filename).to_pylist() + data_list
+    pyarrow.parquet.write_table(_to_table(data_list), filename)
+
+def read_from_parquet(filename: str, fields=[]) -> list[dict]:
+    """
+    :params filename: path to the parquet file
+    :params list[str] fields: list of fields to read. If empty, all fields are read. Only these columns are loaded from the file.
+    :return list[dict]:
+    :raise ValueError: if no record is read from the file
+    :raise FileNotFoundError: if the file is not found
+    """
+    _require_pyarrow()
+    if not os.path.exists(filename):
+        raise FileNotFoundError(f"File \"{filename}\" not found. You are likely to read from a non-existent file.")
+    columns = None
+    if fields:
+        available = set(pyarrow.parquet.read_schema(filename).names)
+        columns = [field for field in fields if field in available]
+    data_list = pyarrow.parquet.read_table(filename, columns=columns).to_pylist() if columns != [] else []
+    if len(data_list) == 0:
+        raise ValueError(f"No available field is found in \"{filename}\". It's likely empty or not containing the fields specified.")
+    return data_list
@@ -6,7 +6,6 @@ from text_preprocessors import model_binary_scoring_cot_preprocessor, model_bina
 import logging
 
 load_dotenv()
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def make_judge_prompt():
@@ -24,6 +24,9 @@ async def STRICT_MATCH(response: str, answer: str, context="") -> float:
 
 def _STRICT_MATCH(response: str, answer: str, context="") -> float:
     return float(response == answer)
+
+# Judgers cheap enough to run on the event loop, by their synchronous implementation. ResponseSet.judge calls these directly instead of hopping to a worker thread for every response.
+INLINE_JUDGERS = {STRICT_MATCH: _STRICT_MATCH}
     
 async def TEXT_SIMILARITY(response: str, answer: str, context="") -> float:
     """
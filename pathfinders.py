@@ -5,27 +5,48 @@ But it does not perform any I/O operation.
 """
 
 from dataset_models import QuerySet
+import functools
 import re
 import os 
 
-def list_files_in_directory(directory, match_pattern=""):
+def list_files_in_directory(directory, match_pattern="", file_ext=""):
     """
     :params str directory: the directory path to look up in
     :params str match_pattern: Optional. The specific filename pattern to look for.
-    :return: A list of qualified file paths in the directory. e.g. `path/to/your/file.ext`
+    :params str file_ext: Optional. Only select file names ending with this extension e.g. ".csv". Unlike match_pattern, `data.csv.bak` is left out.
+    :return: A list of qualified file paths in the directory and its subdirectories, sorted. e.g. `path/to/your/file.ext`
     """
     file_paths = []
-    for root, _, files in os.walk(directory):
-        for file in files:
-            matched = True
-            # If provided match_pattern, will select only the qualified file names
-            if match_pattern != "":
-                matched = match_pattern in file
-
-            if matched:
-                file_paths.append(os.path.join(root, file))
+    # Walk the tree with scandir. DirEntry caches the file type from the directory listing, so no stat call per file.
+    pending_dirs = [directory]
+    while pending_dirs:
+        try:
+            entries = os.scandir(pending_dirs.pop())
+        except OSError:
+            # Like os.walk, skip directories that cannot be listed
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir():
+                    # Like os.walk, do not descend into symlinked directories
+                    if not entry.is_symlink():
+                        pending_dirs.append(entry.path)
+                # If provided match_pattern / file_ext, will select only the qualified file names
+                elif entry.name.endswith(file_ext) and match_pattern in entry.name:
+                    file_paths.append(entry.path)
+    # Sorted, so that subsets are always evaluated in the same order
+    file_paths.sort()
     return file_paths
 
+@functools.lru_cache(maxsize=64)
+def list_files_in_directory_cached(directory, match_pattern="", file_ext="") -> tuple[str, ...]:
+    """
+    Memoized `list_files_in_directory`. Each dataset directory is only walked once per process, e.g. when several models are evaluated against the same dataset. Call `list_files_in_directory_cached.cache_clear()` if the directory changes.
+    
+    :return tuple: The qualified file paths. A tuple, so that callers cannot modify the cached listing.
+    """
+    return tuple(list_files_in_directory(directory, match_pattern, file_ext))
+
 def craft_result_path(query_set: QuerySet, results_dir, dataset_name, model, file_ext="xlsx"):
     """
     Crafts a filename (**xlsx format**) for evaluation results of query_set. e.g. `results_dir/dataset_name/model/test-model-query_set_name.xlsx`
@@ -37,19 +58,27 @@ def craft_result_path(query_set: QuerySet, results_dir, dataset_name, model, fil
     :params file_ext: Optional. Use destination formats other than xlsx.
     :return: The target filename.
     """
-    file_path = query_set.get_path()
-    query_name = "nameless"
-    # query_name can be None as a QuerySet instance might be instantiated with a literal query list. See class data_model.QuerySet.
-    if file_path != None:
-        query_name = parse_filename_from_path(query_set.get_path())
+    # file_path can be None as a QuerySet instance might be instantiated with a literal query list. See class data_model.QuerySet.
+    return f'{craft_eval_dir_path(results_dir, dataset_name, model)}/{_craft_result_name(query_set.get_path())}.{file_ext}'
+
+@functools.lru_cache(maxsize=1024)
+def _craft_result_name(file_path: str | None) -> str:
+    """
+    The sanitized result file name of a query set file e.g. `path/to/your/fi le.ext` => `fi_le`. `nameless` if the query set has no file path.
     
-    return f'{strip_trailing_slashes_from_path(results_dir)}/{dataset_name}/{model}/{sanitize_pathname(f"{query_name}")}.{file_ext}'
+    Memoized like parse_filename_from_path, so that the name is parsed and sanitized once per subset file.
+    """
+    query_name = "nameless" if file_path is None else parse_filename_from_path(file_path)
+    return sanitize_pathname(query_name)
 
+@functools.lru_cache(maxsize=1024)
 def craft_eval_dir_path(results_dir, dataset_name, model):
     """
     Similar to make_result_path, but only reaches directory level. You get:
     `results_dir/dataset_name/model`
     
+    Memoized, as every subset of an evaluation shares the same directory.
+    
     :params str results_dir: The desetination directory for evaluation results.
     :params str dataset_name: Mark the results as part of a dataset
     :params str model: The evaluated model name for identifying result files
@@ -57,20 +86,25 @@ def craft_eval_dir_path(results_dir, dataset_name, model):
     """
     return f'{strip_trailing_slashes_from_path(results_dir)}/{dataset_name}/{model}'
 
+@functools.lru_cache(maxsize=1024)
 def parse_filename_from_path(file_path):
     """
     e.g. `path/to/your/file.ext` => `file`
+    
+    Memoized, as the same subset paths are parsed for every task and every result file.
     """
     query_name, _ = os.path.splitext(os.path.basename(file_path))
     return query_name
 
+_UNUSABLE_PATH_CHARS = re.compile(r'[^\w\-_\.]')
+
 def sanitize_pathname(pathname):
     """
     Replace unusable characters with underscores. Usable characters: [A-Za-z0-9], hyphen, underscore, period
     
     e.g. `@ gre^t filen@me` => `__gre_t_filen_me`
     """
-    return re.sub(r'[^\w\-_\.]', '_', f"{pathname}")
+    return _UNUSABLE_PATH_CHARS.sub('_', str(pathname))
 
 def strip_trailing_slashes_from_path(path_str: str):
     """
@@ -6,98 +6,152 @@ from aiohttp import ClientTimeout
 from aiohttp import ClientTimeout, ClientError
 import dotenv
 import os
+import random
+import datetime
+import email.utils
+from io_managers import json_codec
+from request_manager.llm_cache import CACHE_POLICIES, LLM_CACHE_POLICY, LLMCache, cache_reads, cache_writes, make_cache_key
 
 dotenv.load_dotenv()
 
 TIMEOUT = int(os.getenv("TIMEOUT", 144))
 MAX_ATTEMPTS = int(os.getenv("MAX_ATTEMPTS", 3))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY") or 1.0)
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-async def do_request_on(session, request_text, **request_params):
+async def do_request_on(session, request_text, request_template):
     """
     Send post request to OAI api in async fashion. An aiohttp session is managed externally.
     
     :params session:  an aiohttp.ClientSession object
     :params request_text:  a single request string sent to API
-    :param request_params: Request parameters in body e.g. temperature
+    :params request_template: The parts of the request shared by a batch, made by `make_request_template`
     :return: Coroutine -> response dict | None
     """
-    API_URL = request_params["api_url"]
-    API_KEY = request_params["api_key"]
+    API_URL = request_template["api_url"]
+    headers = request_template["headers"]
+    cache_policy = request_template["cache_policy"]
     
-    headers = {
-        'Authorization': f'Bearer {API_KEY}',
-        'Content-Type': 'application/json'
-    }
-    
-    request_body = make_request_body(request_text, **request_params)
+    request_body = make_request_body(request_text, request_template)
     timeout = ClientTimeout(total=TIMEOUT)
 
+    if cache_policy != "disabled":
+        cache_key = make_cache_key(API_URL, request_body)
+    if request_template["cache_read"]:
+        cached_body = LLMCache().get(cache_key)
+        if cached_body is not None:
+            return cached_body
+    if cache_policy == "replay":
+        logger.error("Response not found in cache, not sent in replay mode: %s...", str(request_text)[:50])
+        return None
 
-    for attempt in range(MAX_ATTEMPTS):
+    max_attempts = request_template["max_attempts"]
+    retry_base_delay = request_template["retry_base_delay"]
+    for attempt in range(max_attempts):
+        retry_after = None
         try:
-            async with session.post(API_URL, json=request_body, headers=headers, timeout=timeout) as response:
+            async with session.post(API_URL, data=json_codec.dumps(request_body), headers=headers, timeout=timeout) as response:
                 if response.status == 200:
-                    body = await response.json()
+                    raw_body = await response.read()
+                    body = json_codec.loads(raw_body) if raw_body.strip() else None
                     if body != None:
+                        if cache_writes(cache_policy) and _is_cacheable(body):
+                            await LLMCache().aset(cache_key, body)
                         return body
                     
                     # Server-side issue, returns empty body with 200 code
-                    if attempt < MAX_ATTEMPTS:
-                        logger.warning(f"API returned 200 but with empty response body. Response: {await response.text()}.  Attempt {attempt + 1} of {MAX_ATTEMPTS}")
-                    else:
-                        logger.error(f"API returned 200 but with empty response body. Response: {await response.text()}")
-                        return None
+                    logger.warning("API returned 200 but with empty response body. Attempt %d of %d", attempt + 1, max_attempts)
+                
+                # Rate limited or server-side error, worth retrying
+                elif _is_retryable_status(response.status):
+                    retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+                    logger.warning("API request failed with status %s. Response: %s. Attempt %d of %d", response.status, await _read_text(response), attempt + 1, max_attempts)
                 
-                # Non 200 code
+                # Other client errors e.g. 400 / 401 won't be fixed by retrying
                 else:
-                    if attempt < MAX_ATTEMPTS: 
-                        logger.warning(f"API request failed with status {response.status}. Response: {await response.text()}. Attempt {attempt + 1} of {MAX_ATTEMPTS}")
-                        await asyncio.sleep(1)  # Wait for 1 second before retrying
-                    else:
-                        logger.error(f"API request failed with status {response.status}. Response: {await response.text()}")
-                        return None
+                    logger.error("API request failed with status %s. Response: %s", response.status, await _read_text(response))
+                    return None
         
         # Request timeout
         except asyncio.TimeoutError:
-            if attempt < MAX_ATTEMPTS:
-                logger.warning(f"API request timed out after {TIMEOUT} seconds. Attempt {attempt + 1} of {MAX_ATTEMPTS}")
-                await asyncio.sleep(1)  # Wait for 1 second before retrying
-            else:
-                logger.error(f"API request timed out after {MAX_ATTEMPTS} attempts")
-                return None
+            logger.warning("API request timed out after %s seconds. Attempt %d of %d", TIMEOUT, attempt + 1, max_attempts)
         
-        # Client Error
+        # Client Error e.g. connection reset
         except ClientError as e:
-            if attempt < MAX_ATTEMPTS:
-                logger.warning(f"API request error: {str(e)}. Attempt {attempt + 1} of {MAX_ATTEMPTS}")
-            else:
-                logger.error(f"API request failed after {MAX_ATTEMPTS} attempts")
-            return None
+            logger.warning("API request error: %s. Attempt %d of %d", e, attempt + 1, max_attempts)
         
         # Unknown error
         except Exception as e:
-            logger.error(f"An error occurred during the API request: {str(e)}")
-            if attempt < MAX_ATTEMPTS:
-                logger.warning(f"API request failed with status {response.status}. Response: {await response.text()}. Attempt {attempt + 1} of {MAX_ATTEMPTS}")
-            else:
-                logger.error(f"API request failed after {MAX_ATTEMPTS} attempts")
-                return None
+            logger.warning("An error occurred during the API request: %s. Attempt %d of %d", e, attempt + 1, max_attempts)
     
-        # Wait before retrying
-        if attempt < MAX_ATTEMPTS:
-            await asyncio.sleep(1)
+        # Wait before retrying. Sleeping yields to the other requests in the batch.
+        if attempt < max_attempts - 1:
+            await asyncio.sleep(_backoff_delay(attempt, retry_base_delay, retry_after))
     
-    return None  # This line should never be reached, but it's here for completeness
+    logger.error("API request failed after %d attempts", max_attempts)
+    return None
+
+async def _read_text(response) -> str:
+    """
+    Read the response body as utf-8 text. Unlike `response.text()`, no charset detection is done.
+    """
+    return (await response.read()).decode("utf-8", errors="replace")
+
+def _is_retryable_status(status: int) -> bool:
+    # Request timeout, rate limit and server-side errors
+    return status in (408, 429) or status >= 500
+
+def _parse_retry_after(value: str | None) -> float | None:
+    """
+    Parse a Retry-After header, given either in seconds or as an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max((retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+
+def _backoff_delay(attempt: int, base_delay: float, retry_after: float | None = None) -> float:
+    """
+    Exponential backoff with jitter: base * 2^attempt + [0, 1) seconds. A Retry-After from the server takes precedence.
+    """
+    if retry_after is not None:
+        return retry_after
+    return base_delay * 2 ** attempt + random.random()
+
+def _is_cacheable(OAI_response) -> bool:
+    """
+    Only cache responses with a message content, so that failed generations are retried next time.
+    """
+    message = _get_message(OAI_response)
+    return message is not None and message.get('content') is not None
+
+def _get_message(OAI_response) -> dict | None:
+    """
+    Get `choices[0].message` from a response with `.get` lookups, without raising on malformed responses.
     
-def make_request_body(request_str, **request_params):
+    :return: the message dict, or None if any level is missing
     """
-    Construct the request body.
+    choices = OAI_response.get('choices') if isinstance(OAI_response, dict) else None
+    choice = choices[0] if isinstance(choices, list) and choices else None
+    message = choice.get('message') if isinstance(choice, dict) else None
+    return message if isinstance(message, dict) else None
+
+def make_request_template(**request_params) -> dict:
+    """
+    Construct everything in a request that does not depend on the request string: headers, model parameters, system message, prefix and suffix. Build it once per batch and pass it to `do_request_on`.
     
-    :params request_str:  a single request string sent to API
-    :params request_params: Request parameters in body e.g. temperature
+    :params request_params: Request parameters e.g. temperature. cache_policy overrides LLM_CACHE_POLICY in .env file, no_cache=True is the same as cache_policy="disabled". max_attempts and retry_base_delay override MAX_ATTEMPTS and RETRY_BASE_DELAY in .env file.
+    :return dict: {"api_url", "headers", "cache_policy", "cache_read", "max_attempts", "retry_base_delay", "body", "messages", "prefix", "suffix"}
     """
     params = {}
     try:
@@ -131,25 +185,78 @@ def make_request_body(request_str, **request_params):
     messages=[]
     if system_prompt != "":
         messages.append({"role": "system", "content": system_prompt})
-    messages.append({"role": "user", "content": f"{prefix}{request_str}{suffix}"})
     # By this moment, prefix, suffix and system prompt should no more exist in request_params
 
     request_params.pop("base_url")
-    request_params.pop("api_url")
-    request_params.pop("api_key")
+    API_URL = request_params.pop("api_url")
+    API_KEY = request_params.pop("api_key")
+    cache_policy = str(request_params.pop("cache_policy", LLM_CACHE_POLICY)).strip().lower()
+    if cache_policy not in CACHE_POLICIES:
+        raise ValueError(f"Unknown cache_policy \"{cache_policy}\". Choose from: {", ".join(CACHE_POLICIES)}.")
+    if request_params.pop("no_cache", False):
+        cache_policy = "disabled"
+    max_attempts = max(int(request_params.pop("max_attempts", MAX_ATTEMPTS)), 1)
+    retry_base_delay = float(request_params.pop("retry_base_delay", RETRY_BASE_DELAY))
     # Shouldn't be present in actual request
 
-    request = {"messages": messages}
+    headers = {
+        'Authorization': f'Bearer {API_KEY}',
+        'Content-Type': 'application/json'
+    }
+
+    body = {}
     for key, value in params.items():
-        request[key] = value
+        body[key] = value
         
     # Add remaining request_params
     for key, value in request_params.items():
-        request[key] = value
+        body[key] = value
     # Patch in 2.1.2: Forbid stream output
-    request.update({"stream": False})
+    body.update({"stream": False})
     
-    return request
+    return {
+        "api_url": API_URL,
+        "headers": headers,
+        "cache_policy": cache_policy,
+        # process_batch looks up a whole batch at once and turns this off for the requests it sends
+        "cache_read": cache_reads(cache_policy),
+        "max_attempts": max_attempts,
+        "retry_base_delay": retry_base_delay,
+        "body": body,
+        "messages": messages,
+        "prefix": prefix,
+        "suffix": suffix
+    }
+
+def make_request_body(request_str, request_template):
+    """
+    Construct the request body.
+    
+    :params request_str:  a single request string sent to API
+    :params request_template: made by `make_request_template`
+    """
+    prefix = request_template["prefix"]
+    suffix = request_template["suffix"]
+    # Most workers have neither prefix nor suffix. Send the request string as is instead of copying it.
+    if prefix or suffix:
+        content = "".join((prefix, str(request_str), suffix))
+    else:
+        content = request_str if isinstance(request_str, str) else str(request_str)
+    messages = request_template["messages"] + [{"role": "user", "content": content}]
+    return {"messages": messages, **request_template["body"]}
+
+def lookup_cached_responses(request_list, request_template) -> list[dict | None]:
+    """
+    Look up the cached responses of a batch of requests in a few queries.
+    
+    :params request_list: request strings sent to API
+    :params request_template: made by `make_request_template`
+    :return: The cached response body of each request, None if it is not cached
+    """
+    API_URL = request_template["api_url"]
+    keys = [make_cache_key(API_URL, make_request_body(request_text, request_template)) for request_text in request_list]
+    found = LLMCache().get_many(keys)
+    return [found.get(key) for key in keys]
 
 NONE_CONTENT_ERROR_MSG = "Received None content."
 
@@ -167,22 +274,18 @@ def extract_content(OAI_response, enable_metrics) -> dict[str, int | str]:
     :return dict: {("reasoning_content"), "content", "prompt_tokens", "completion_tokens"}
     """
     extracted = dict()
+    message = _get_message(OAI_response)
     # Try parse reasoning content
-    try:
-        reasoning_content = OAI_response['choices'][0]['message']['reasoning_content']
-        extracted.update({"reasoning_content": reasoning_content})
-    except (TypeError, KeyError, IndexError):
-        pass
+    if message is not None and "reasoning_content" in message:
+        extracted.update({"reasoning_content": message["reasoning_content"]})
     # choices
-    try:
-        msg = OAI_response['choices'][0]['message']['content']
-        if msg is None:
-            raise ValueError
-    except (TypeError, KeyError, IndexError):
-        logger.error(f"Failed to extract content from API response: {OAI_response}")
+    if message is None or "content" not in message:
+        logger.error("Failed to extract content from API response: %s", OAI_response)
         msg = ''
-    except ValueError:
+    elif message["content"] is None:
         msg = NONE_CONTENT_ERROR_MSG
+    else:
+        msg = message["content"]
     extracted.update({"content": msg})
         # {
         #     'usage': 
@@ -192,15 +295,16 @@ def extract_content(OAI_response, enable_metrics) -> dict[str, int | str]:
         #         }
         # }
     if enable_metrics:
-        try:
-            prompt_tokens = OAI_response['usage']['prompt_tokens']
-        except (TypeError, KeyError, IndexError):
-            logger.error(f"Failed to extract prompt token usage from API response: {OAI_response}")
+        usage = OAI_response.get('usage') if isinstance(OAI_response, dict) else None
+        if not isinstance(usage, dict):
+            usage = {}
+        prompt_tokens = usage.get('prompt_tokens')
+        if prompt_tokens is None:
+            logger.error("Failed to extract prompt token usage from API response: %s", OAI_response)
             prompt_tokens = 0
-        try:
-            completion_tokens = OAI_response['usage']['completion_tokens']
-        except (TypeError, KeyError, IndexError):
-            logger.error(f"Failed to extract completion token usage from API response: {OAI_response}")
+        completion_tokens = usage.get('completion_tokens')
+        if completion_tokens is None:
+            logger.error("Failed to extract completion token usage from API response: %s", OAI_response)
             completion_tokens = 0
         extracted.update({
             "prompt_tokens": prompt_tokens,
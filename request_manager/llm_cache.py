@@ -0,0 +1,144 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import dotenv
+from io_managers import json_codec
+
+dotenv.load_dotenv()
+
+LLM_CACHE_TTL_DAYS = float(os.getenv("LLM_CACHE_TTL_DAYS") or 7)
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH") or "cache/llm_cache.sqlite3"
+# enabled: read and write | read_only: never store new responses | write_only: always request, then store | replay: read only, a batch with uncached requests fails before anything is sent | disabled
+CACHE_POLICIES = ("enabled", "read_only", "write_only", "replay", "disabled")
+LLM_CACHE_POLICY = (os.getenv("LLM_CACHE_POLICY") or "enabled").strip().lower()
+# sqlite limits the number of bound parameters in a query
+LOOKUP_CHUNK_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+# Deprecated. LLM_CACHE_ENABLED=false is read as LLM_CACHE_POLICY=disabled.
+if (os.getenv("LLM_CACHE_ENABLED") or "true").strip().lower() not in ("1", "true", "yes", "on"):
+    logger.warning("LLM_CACHE_ENABLED is deprecated. Set LLM_CACHE_POLICY=disabled instead.")
+    LLM_CACHE_POLICY = "disabled"
+
+if LLM_CACHE_POLICY not in CACHE_POLICIES:
+    raise ValueError(f"Unknown LLM_CACHE_POLICY \"{LLM_CACHE_POLICY}\". Choose from: {", ".join(CACHE_POLICIES)}.")
+
+def cache_reads(policy: str) -> bool:
+    return policy in ("enabled", "read_only", "replay")
+
+def cache_writes(policy: str) -> bool:
+    return policy in ("enabled", "write_only")
+
+def make_cache_key(api_url: str, request_body: dict) -> str:
+    """
+    Hash a request into a cache key. The full request body is included, so model, sampling parameters, system prompt, prefix/suffix and the query itself all take part in the key.
+
+    :params str api_url: The url the request is sent to
+    :params dict request_body: The request body made by `make_request_body`
+    :return str: A sha256 hex digest
+    """
+    canonical_body = json.dumps(request_body, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(f"{api_url}|{canonical_body}".encode("utf-8")).hexdigest()
+
+class LLMCache:
+    """
+    An on-disk response cache backed by sqlite (WAL mode). Responses older than LLM_CACHE_TTL_DAYS are treated as missing. Set LLM_CACHE_TTL_DAYS=0 to keep them forever.
+
+    Cache errors never fail a request: they are logged and treated as a miss.
+
+    Use `aset` inside coroutines. Writes then run one at a time in a dedicated thread, so that a commit never blocks the event loop.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(LLMCache, cls).__new__(cls)
+            cls._instance.connection = None
+            # The connection is shared by the event loop (lookups) and the write thread
+            cls._instance.lock = threading.Lock()
+            cls._instance.write_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm_cache")
+        return cls._instance
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if self.connection is None:
+            cache_dir = os.path.dirname(LLM_CACHE_PATH)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            connection = sqlite3.connect(LLM_CACHE_PATH, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)")
+            connection.commit()
+            self.connection = connection
+        return self.connection
+
+    def get(self, key: str) -> dict | None:
+        """
+        :params str key: A key made by `make_cache_key`
+        :return: The cached response body, or None on miss/expiry
+        """
+        try:
+            with self.lock:
+                row = self._get_connection().execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("LLM cache lookup failed: %s", e)
+            return None
+        if row is None:
+            return None
+        response, created_at = row
+        if LLM_CACHE_TTL_DAYS > 0 and time.time() - created_at > LLM_CACHE_TTL_DAYS * 86400:
+            return None
+        return json_codec.loads(response)
+
+    def get_many(self, keys: list[str]) -> dict[str, dict]:
+        """
+        Look up many keys with a few `SELECT ... WHERE key IN (...)` queries instead of one query per key.
+        
+        :params list[str] keys: Keys made by `make_cache_key`
+        :return dict: The cached response bodies by key. Missing or expired keys are left out.
+        """
+        found = {}
+        min_created_at = time.time() - LLM_CACHE_TTL_DAYS * 86400 if LLM_CACHE_TTL_DAYS > 0 else float("-inf")
+        distinct_keys = list(dict.fromkeys(keys))
+        try:
+            with self.lock:
+                connection = self._get_connection()
+                for start in range(0, len(distinct_keys), LOOKUP_CHUNK_SIZE):
+                    chunk = distinct_keys[start:start + LOOKUP_CHUNK_SIZE]
+                    placeholders = ",".join("?" * len(chunk))
+                    for key, response, created_at in connection.execute(f"SELECT key, response, created_at FROM responses WHERE key IN ({placeholders})", chunk):
+                        if created_at >= min_created_at:
+                            found[key] = json_codec.loads(response)
+        except sqlite3.Error as e:
+            logger.warning("LLM cache lookup failed: %s", e)
+        return found
+
+    def set(self, key: str, value: dict):
+        """
+        :params str key: A key made by `make_cache_key`
+        :params dict value: The response body to store. Stored with a UTC timestamp.
+        """
+        response = json_codec.dumps(value)
+        try:
+            with self.lock:
+                connection = self._get_connection()
+                connection.execute("INSERT OR REPLACE INTO responses (key, response, created_at) VALUES (?, ?, ?)", (key, response, time.time()))
+                connection.commit()
+        except sqlite3.Error as e:
+            logger.warning("LLM cache write failed: %s", e)
+
+    async def aset(self, key: str, value: dict):
+        """
+        Same as `set`, but the write runs in the cache write thread so that the event loop keeps serving other requests meanwhile.
+
+        :params str key: A key made by `make_cache_key`
+        :params dict value: The response body to store
+        """
+        await asyncio.get_running_loop().run_in_executor(self.write_executor, self.set, key, value)
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import os
+import time
+import dotenv
+
+dotenv.load_dotenv()
+
+# Requests / tokens per minute allowed for each worker. 0 = no limit
+RATE_LIMIT_RPM = int(os.getenv("RATE_LIMIT_RPM") or 0)
+RATE_LIMIT_TPM = int(os.getenv("RATE_LIMIT_TPM") or 0)
+
+logger = logging.getLogger(__name__)
+
+def estimate_tokens(text) -> int:
+    """
+    A rough token count without a tokenizer: about 4 utf-8 bytes per token. This holds for English (1 byte per char, ~4 chars per token) and roughly for Chinese (3 bytes per char, ~1.3 chars per token).
+    """
+    return len(str(text).encode("utf-8")) // 4 + 1
+
+class RateLimiter:
+    """
+    A token bucket limiter for requests per minute (RPM) and tokens per minute (TPM). Both buckets start full and refill continuously, so a request only waits when a bucket actually runs dry.
+    """
+    def __init__(self, rpm: int = RATE_LIMIT_RPM, tpm: int = RATE_LIMIT_TPM):
+        """
+        :params int rpm: Requests per minute. 0 = no limit
+        :params int tpm: Tokens (prompt + completion) per minute. 0 = no limit
+        """
+        self.rpm = max(rpm, 0)
+        self.tpm = max(tpm, 0)
+        self.request_tokens = float(self.rpm)
+        self.token_tokens = float(self.tpm)
+        self.last_update = time.monotonic()
+        # Waiting requests are served first come first served
+        self.lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rpm > 0 or self.tpm > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.last_update = now
+        if self.rpm > 0:
+            self.request_tokens = min(self.rpm, self.request_tokens + elapsed * self.rpm / 60)
+        if self.tpm > 0:
+            self.token_tokens = min(self.tpm, self.token_tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, estimated_tokens: int = 0):
+        """
+        Wait until both buckets can afford one request of `estimated_tokens` tokens, then take them.
+        
+        :params int estimated_tokens: Expected prompt + completion tokens of the request. Capped at TPM, so a single large request never waits forever.
+        """
+        if not self.enabled:
+            return
+        async with self.lock:
+            estimated_tokens = min(estimated_tokens, self.tpm) if self.tpm > 0 else 0
+            while True:
+                self._refill()
+                wait = 0.0
+                if self.rpm > 0 and self.request_tokens < 1:
+                    wait = (1 - self.request_tokens) * 60 / self.rpm
+                if self.tpm > 0 and self.token_tokens < estimated_tokens:
+                    wait = max(wait, (estimated_tokens - self.token_tokens) * 60 / self.tpm)
+                if wait <= 0:
+                    break
+                logger.debug("Rate limited, waiting %.2f seconds.", wait)
+                await asyncio.sleep(wait)
+            if self.rpm > 0:
+                self.request_tokens -= 1
+            if self.tpm > 0:
+                self.token_tokens -= estimated_tokens
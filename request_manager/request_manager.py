@@ -1,20 +1,35 @@
+import functools
 import os
-from typing import Tuple
+import time
+from typing import Awaitable, Callable, Tuple
 from dotenv import load_dotenv
 import asyncio
 import aiohttp
-from request_manager.api_actions import do_request_on, extract_content
+import yarl
+from request_manager.api_actions import do_request_on, extract_content, lookup_cached_responses, make_request_body, make_request_template
+from request_manager.llm_cache import make_cache_key
+from request_manager.rate_limiter import RateLimiter, estimate_tokens
 import logging
 
 load_dotenv()
 
 MAX_CONCURRENT_REQUESTS = int(os.getenv('BATCH_SIZE', "5"))
+# Connection pool size of the shared session. Invariant: MAX_CONCURRENT_REQUESTS <= CONNECTOR_LIMIT (0 means unlimited for both), otherwise requests holding the semaphore will still queue for a socket.
+CONNECTOR_LIMIT = int(os.getenv("CONNECTOR_LIMIT") or MAX_CONCURRENT_REQUESTS)
+# Max requests of one batch in flight at a time, i.e. the size of its worker pool. Bounds the coroutines and sockets of a large batch when BATCH_SIZE is 0 (unlimited).
+REQUEST_WINDOW = int(os.getenv("REQUEST_WINDOW") or 1000)
+# How many connections to open (and TLS-handshake) to an api host before its first batch. 0 = disabled
+WARM_UP_CONNECTIONS = int(os.getenv("WARM_UP_CONNECTIONS") or 0)
+# Send a 1-token request before an evaluation starts, so that a lazily loaded model is loaded before the first batch
+WARM_UP_REQUEST = os.getenv("WARM_UP_REQUEST", "false").strip().lower() in ("1", "true", "yes", "on")
 FALLBACK_ERR_MSG = "Unknown error in processing request"
+EMPTY_QUERY_MSG = "Empty query, request skipped"
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+if MAX_CONCURRENT_REQUESTS > 0 and 0 < CONNECTOR_LIMIT < MAX_CONCURRENT_REQUESTS:
+    logger.warning(f"CONNECTOR_LIMIT ({CONNECTOR_LIMIT}) is lower than BATCH_SIZE ({MAX_CONCURRENT_REQUESTS}). Concurrency will be capped by the connection pool.")
+
 class RequestResourceManager:
     _instance = None
 
@@ -22,25 +37,234 @@ class RequestResourceManager:
         if cls._instance is None:
             cls._instance = super(RequestResourceManager, cls).__new__(cls)
             cls._instance.semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS) if MAX_CONCURRENT_REQUESTS > 0 else None
+            cls._instance.session = None
+            cls._instance.session_loop = None
+            cls._instance.warmed_up_hosts = set()
+            # Requests being sent, by request hash. Identical requests from concurrent batches wait for the same response.
+            cls._instance.in_flight = {}
         return cls._instance
 
     def get_semaphore(self) -> asyncio.Semaphore:
         return self._instance.semaphore
 
-async def process_batch(request_list: list[str], request_params: dict, enable_metrics=False) -> list[dict[str, str] | dict[str, int | str]]:
+    async def get_session(self) -> aiohttp.ClientSession:
+        """
+        Get the aiohttp session shared by all requests. It is created lazily on first use, so that its connection pool (and the keep-alive connections in it) is reused across batches instead of being rebuilt for each of them.
+        
+        A session is bound to the event loop it is created in. If the running loop has changed (e.g. another `asyncio.run`), a new session is created.
+        """
+        loop = asyncio.get_running_loop()
+        if self.session is None or self.session.closed or self.session_loop is not loop:
+            connector = aiohttp.TCPConnector(limit=CONNECTOR_LIMIT, limit_per_host=CONNECTOR_LIMIT, ttl_dns_cache=300, keepalive_timeout=75)
+            # Total timeout is set per request in api_actions module.
+            self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=None, sock_connect=30))
+            self.session_loop = loop
+            self.warmed_up_hosts = set()
+            self.in_flight = {}
+        return self.session
+
+    async def warm_up(self, api_url: str, n: int = WARM_UP_CONNECTIONS):
+        """
+        Open n pooled connections to the host of api_url with concurrent HEAD requests, so that the first batch does not pay for the TCP/TLS handshakes. Done once per host per session. The response status does not matter.
+        
+        :param str api_url: Any url on the api host
+        :param int n: How many connections to open. Capped by CONNECTOR_LIMIT. 0 = do nothing
+        """
+        if CONNECTOR_LIMIT > 0:
+            n = min(n, CONNECTOR_LIMIT)
+        origin = str(yarl.URL(api_url).origin())
+        if n <= 0 or origin in self.warmed_up_hosts:
+            return
+        self.warmed_up_hosts.add(origin)
+        session = await self.get_session()
+
+        async def head():
+            try:
+                async with session.head(origin, allow_redirects=False, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                    await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.debug("Warm-up request to %s failed: %s", origin, e)
+
+        await asyncio.gather(*[head() for _ in range(n)])
+
+    async def coalesce(self, key: str, send: Callable[[], Awaitable[dict]]) -> tuple[dict, bool]:
+        """
+        Send a request unless an identical one is already in flight, in which case share its response.
+        
+        :param str key: The request hash, see `make_cache_key`
+        :param send: Coroutine function sending the request
+        :return: The processed response, and whether it was shared from another caller's request. Each caller gets its own copy.
+        """
+        leader = self.in_flight.get(key)
+        if leader is not None:
+            try:
+                return dict(await asyncio.shield(leader)), True
+            except asyncio.CancelledError:
+                # The request we waited for was cancelled, not us. Send it ourselves.
+                if asyncio.current_task().cancelling():
+                    raise
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        try:
+            result = await send()
+            future.set_result(result)
+            return result, False
+        finally:
+            if not future.done():
+                future.cancel()
+            if self.in_flight.get(key) is future:
+                del self.in_flight[key]
+
+    async def close_session(self):
+        """
+        Close the shared session if it is open. Call it before the event loop shuts down.
+        """
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+        self.session_loop = None
+        self.warmed_up_hosts = set()
+
+def use_uvloop() -> bool:
+    """
+    Switch asyncio to uvloop's event loop policy if uvloop is installed (`pip install uvloop`, not available on Windows). Call it before `asyncio.run`.
+    
+    :return bool: Whether uvloop is in use
+    """
+    try:
+        import uvloop
+    except ImportError:
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+async def close_session():
+    """
+    Close the aiohttp session shared by all requests. Call it at the end of your entry coroutine e.g. `main()` in run.py.
+    """
+    await RequestResourceManager().close_session()
+
+async def warm_up(request_params: dict):
     """
-    Process a list of request strings asynchronously, with a semaphore of size BATCH_SIZE set in .env file.
+    Prepare an api before its first batch: open WARM_UP_CONNECTIONS pooled connections and, if WARM_UP_REQUEST is enabled, send a 1-token request whose response is discarded. It never uses the response cache, and is skipped in replay mode.
+    
+    :param request_params: Request parameters of the worker, see `make_request_template`
+    """
+    resource_manager = RequestResourceManager()
+    request_template = make_request_template(**request_params)
+    await resource_manager.warm_up(request_template["api_url"])
+    if not WARM_UP_REQUEST or request_template["cache_policy"] == "replay":
+        return
+    request_template = {
+        **request_template,
+        "cache_policy": "disabled",
+        "cache_read": False,
+        "max_attempts": 1,
+        "body": {**request_template["body"], "max_tokens": 1}
+    }
+    session = await resource_manager.get_session()
+    started_at = time.monotonic()
+    response = await do_request_on(session, "ping", request_template)
+    logger.info("Warm-up request to %s %s in %.2f seconds.", request_template["body"].get("model"), "succeeded" if response is not None else "failed", time.monotonic() - started_at)
+
+async def process_batch(request_list: list[str], request_params: dict, enable_metrics=False, skip_empty=True, dedup=True, rate_limiter: RateLimiter | None = None) -> list[dict[str, str] | dict[str, int | str]]:
+    """
+    Process a list of request strings asynchronously with a pool of BATCH_SIZE workers, under a global semaphore of size BATCH_SIZE set in .env file.
     
     :param request_list: A list of request strings
     :param request_params: Request parameters in body e.g. temperature
-    :param bool enable_metrics: Default to False. Whether to include usage in results
+    :param bool enable_metrics: Default to False. Whether to include usage in results. Responses read from the cache, or shared with an identical request in flight, report no tokens and "cached": True.
+    :param bool skip_empty: Default to True. Do not send empty/whitespace-only requests. Their content is EMPTY_QUERY_MSG.
+    :param bool dedup: Default to True. Send identical requests only once and share the response. Set to False for independent samples (non-zero temperature).
+    :param RateLimiter rate_limiter: Optional RPM/TPM limiter, usually the one of the worker. Cached and skipped requests do not consume it.
     :return: a list of response strings, or error messages
     """
-    semaphore = RequestResourceManager().get_semaphore()
-    batch_total = len(request_list)
-    async with aiohttp.ClientSession() as session:
-        tasks = [_process_request(request, request_params, session, semaphore=semaphore, request_id=f"{i + 1}/{batch_total}", enable_metrics=enable_metrics) for i, request in enumerate(request_list)]
-        responses = await asyncio.gather(*tasks)
+    resource_manager = RequestResourceManager()
+    semaphore = resource_manager.get_semaphore()
+    session = await resource_manager.get_session()
+    # Headers, model parameters and system message are the same across the batch. Build them once.
+    request_template = make_request_template(**request_params)
+
+    if dedup:
+        # Send each distinct request once, then scatter the responses back to their positions
+        unique_requests = {}
+        order = [unique_requests.setdefault(request, len(unique_requests)) for request in request_list]
+        dispatch_list = list(unique_requests)
+        if len(dispatch_list) < len(request_list):
+            logger.info("%d duplicated requests in the batch will share responses.", len(request_list) - len(dispatch_list))
+    else:
+        dispatch_list = request_list
+    batch_total = len(dispatch_list)
+    responses = [None] * batch_total
+    pending = range(batch_total)
+
+    if request_template["cache_read"]:
+        # Look up the whole batch in a few queries instead of one query per request.
+        # Hashing, the lookup and decoding run in a worker thread, so that other batches keep sending requests meanwhile.
+        cached_bodies = await asyncio.to_thread(lookup_cached_responses, dispatch_list, request_template)
+        pending = []
+        for i, body in enumerate(cached_bodies):
+            if body is not None:
+                responses[i] = extract_content(body, enable_metrics)
+                if enable_metrics:
+                    # No tokens were spent on a cached response. Its usage is left out of the metrics and the hit counted instead.
+                    responses[i].update({"prompt_tokens": 0, "completion_tokens": 0, "cached": True})
+            else:
+                pending.append(i)
+        if skip_empty:
+            # Empty requests are not sent, so they need no cached response
+            missing = [i for i in pending if not _is_empty_request(dispatch_list[i])]
+        else:
+            missing = pending
+        if request_template["cache_policy"] == "replay" and missing:
+            raise ValueError(f"{len(missing)} of {batch_total} requests are not in the response cache. Replay mode never sends requests. First missing request: {str(dispatch_list[missing[0]])[:50]}...")
+        if batch_total:
+            logger.info("%d of %d requests found in the response cache.", batch_total - len(pending), batch_total)
+        # The remaining requests are known misses. Do not look them up again one by one.
+        request_template = {**request_template, "cache_read": False}
+
+    if pending:
+        await resource_manager.warm_up(request_template["api_url"])
+
+    # A fixed pool of workers pulls requests from a queue, so a large batch does not materialize one task per request.
+    # The global semaphore still caps in-flight requests across concurrent batches.
+    queue = asyncio.Queue()
+    for i in pending:
+        queue.put_nowait((i, dispatch_list[i]))
+
+    async def pool_worker():
+        while True:
+            try:
+                i, request = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            if skip_empty and _is_empty_request(request):
+                responses[i] = await send(i, request)
+            elif dedup:
+                # Identical requests of concurrent batches, e.g. two subsets sharing questions, are sent only once as well
+                request_key = make_cache_key(request_template["api_url"], make_request_body(request, request_template))
+                response, shared = await resource_manager.coalesce(request_key, functools.partial(send, i, request))
+                if shared:
+                    # The leader may have been sent with another enable_metrics, and its tokens are already counted by its own batch
+                    response = {key: value for key, value in response.items() if key not in ("prompt_tokens", "completion_tokens", "cached")}
+                    if enable_metrics:
+                        response.update({"prompt_tokens": 0, "completion_tokens": 0, "cached": True})
+                responses[i] = response
+            else:
+                responses[i] = await send(i, request)
+
+    async def send(i, request):
+        if rate_limiter is not None and not (skip_empty and _is_empty_request(request)):
+            await rate_limiter.acquire(estimate_tokens(request) + completion_budget)
+        return await _process_request(request, request_template, session, semaphore=semaphore, request_id=f"{i + 1}/{batch_total}", enable_metrics=enable_metrics, skip_empty=skip_empty)
+
+    completion_budget = int(request_template["body"].get("max_tokens") or 0)
+    # A sliding window: each worker takes the next request as soon as its previous one completes
+    window = min(MAX_CONCURRENT_REQUESTS, REQUEST_WINDOW) if MAX_CONCURRENT_REQUESTS > 0 else REQUEST_WINDOW
+    pool_size = min(max(window, 1), len(pending))
+    await asyncio.gather(*[pool_worker() for _ in range(pool_size)])
+    if dedup:
+        return [dict(responses[i]) for i in order]
     return responses
 
 async def single_request(request: str, request_params: dict) -> dict[str, str] | dict[str, int | str]:
@@ -51,22 +275,33 @@ async def single_request(request: str, request_params: dict) -> dict[str, str] |
     :param request_params: Request parameters e.g. temperature
     :return: a response string or error message
     """
-    async with aiohttp.ClientSession() as session:
-        return await _process_request(request, request_params, session)
+    session = await RequestResourceManager().get_session()
+    return await _process_request(request, make_request_template(**request_params), session)
+
+def _is_empty_request(request) -> bool:
+    return not request or (isinstance(request, str) and not request.strip())
 
-async def _process_request(request, request_params, session, semaphore=None, request_id=None, enable_metrics=False) -> dict[str, str] | dict[str, int | str]:
+async def _process_request(request, request_template, session, semaphore=None, request_id=None, enable_metrics=False, skip_empty=False) -> dict[str, str] | dict[str, int | str]:
     """
     Process a single request as part of a batch operation, where a session and a semaphore are managed externally. Returns a message content string.
     
     Delegate api request and content parsing to api_actions module. 
     
     :param request: The text of the request to process
-    :param request_params: Additional parameters for the request
-    :param session: An active aiohttp.ClientSession
+    :param request_template: The parts of the request shared by a batch, made by `make_request_template`
+    :param session: An active aiohttp.ClientSession, usually the shared one from RequestResourceManager
     :param semaphore: An optional semaphore of size BATCH_SIZE, set in .env file. Leave it as None for single requests
     :param bool enable_metrics: Default to False. Whether to include usage in results
+    :param bool skip_empty: Default to False. Return EMPTY_QUERY_MSG for empty/whitespace-only requests without sending them or taking a semaphore slot
     :return: Processed content or error message
     """
+    if skip_empty and _is_empty_request(request):
+        logger.warning("Skipped an empty query%s.", f" {request_id}" if request_id else "")
+        SKIPPED = {"content": EMPTY_QUERY_MSG}
+        if enable_metrics:
+            SKIPPED.update({"prompt_tokens": 0, "completion_tokens": 0})
+        return SKIPPED
+
     async def _do_request():
         FALLBACK = {"content": FALLBACK_ERR_MSG}
         if enable_metrics:
@@ -74,17 +309,19 @@ async def _process_request(request, request_params, session, semaphore=None, req
 
         try:
             if request == "":
-                logger.warning(f"I found an empty query, but will proceed requesting with it.")
-            response = await do_request_on(session, request, **request_params)
+                logger.warning("I found an empty query, but will proceed requesting with it.")
+            response = await do_request_on(session, request, request_template)
             if response:
                 result = extract_content(response, enable_metrics)
-                logger.info(f"Processed request{f" {request_id}" if request_id else ""}: {request[:50]}...")
+                # Skip building the preview when INFO is off, this runs once per request
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("Processed request%s: %s...", f" {request_id}" if request_id else "", request[:50])
                 return result
             else:
-                logger.error(f"The following request received a void response: {request[:50]}... Response: {response}")
+                logger.error("The following request received a void response: %s... Response: %s", request[:50], response)
                 return FALLBACK
         except Exception as e:
-            logger.error(f"Error processing request: {request[:50]}... Error: {str(e)}")
+            logger.error("Error processing request: %s... Error: %s", request[:50], e)
             return FALLBACK
         
     if semaphore:
@@ -34,7 +34,6 @@ from worker import Worker
 from io_managers import get_writer
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 FALLBACK_FIELD_VALUE="null"
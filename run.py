@@ -1,9 +1,10 @@
-from tqdm import tqdm
+from tqdm.asyncio import tqdm_asyncio
 from dataset_adapters.gpqa import conduct_gpqa
 from dataset_adapters.mmlu import conduct_mmlu
 from worker import RequestParams, Worker
 from dotenv import load_dotenv
 import asyncio
+import logging
 import os
 from dataset_adapters.ifeval import conduct_ifeval
 from dataset_adapters.ceval import conduct_ceval
@@ -14,6 +15,7 @@ from dataset_adapters.mmlu_pro import conduct_mmlu_pro
 from dataset_adapters.supergpqa import conduct_supergpqa
 from prompts import make_en_system_prompt as make_system_prompt, make_zh_system_prompt as make_zh_system_prompt
 from text_preprocessors import mcq_search_preprocessor
+from request_manager.request_manager import close_session, use_uvloop
 
 load_dotenv()
 
@@ -166,8 +168,13 @@ async def main():
     # await asyncio.gather(*tasks)
     tasks = [subtask2(), subtask3(), subtask4(), subtask5(), subtask6(), subtask7(), subtask8(), subtask9()]
     # Display a task completion progress bar
-    for completed_task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Task completion progress", position=0):
+    # No progress bar when stderr is not a terminal e.g. redirected to a log file. Redraw at most once a second.
+    for completed_task in tqdm_asyncio.as_completed(tasks, desc="Task completion progress", position=0, disable=None, mininterval=1.0):
         await completed_task
+    # Release the pooled connections before the event loop shuts down
+    await close_session()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    use_uvloop()
     asyncio.run(main())
\ No newline at end of file
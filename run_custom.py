@@ -1,9 +1,11 @@
 from dataset_adapters.custom_test import run_test
 from worker import RequestParams, Worker
 import asyncio
+import logging
 from dotenv import load_dotenv
 from judgers.presets import MODEL_SCORING, STRICT_MATCH, TEXT_SIMILARITY
 from text_preprocessors import as_is, mcq_preprocessor, mcq_cot_preprocessor
+from request_manager.request_manager import close_session, use_uvloop
 import os
 
 load_dotenv()
@@ -64,5 +66,8 @@ async def run_custom():
     await run_test(QUERY_FILE_PATH, 
                    [worker1], 
                    output_dir=OUTPUT_DIR, test_mode=True, **test_set_parameters)
+    await close_session()
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    use_uvloop()
     asyncio.run(run_custom())
\ No newline at end of file
@@ -1,6 +1,8 @@
 from dataset_adapters.batch_query import batch_query
 from worker import RequestParams, Worker
+from request_manager.request_manager import close_session, use_uvloop
 import asyncio
+import logging
 from dotenv import load_dotenv
 import os
 
@@ -42,6 +44,9 @@ async def run_requests_only():
     industrious_worker = Worker(RequestParams(**worker_profile))
     
     await batch_query(QUERY_FILE_PATH, [industrious_worker], output_dir=OUTPUT_DIR, test_mode=True, query_key=QUERY_KEY)
+    await close_session()
     
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    use_uvloop()
     asyncio.run(run_requests_only())
\ No newline at end of file
@@ -8,14 +8,26 @@ When empty string is encountered at any stage of the pipeline, the workflow is h
 
 import re
 import logging
+import string
+from typing import Callable
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 THINK_FAILED_MSG = "Thinking process failed."
 ANSWER_FAILED_MSG = "No valid answer field was found. Fall back to false."
 from request_manager.api_actions import NONE_CONTENT_ERROR_MSG
 
+# Preprocessors run once per response. Compile their patterns once instead of looking them up in re's cache on every call.
+# See the methods using them for what they match.
+_ANSWER_TAG_PATTERN = re.compile("<[Aa]nswer>([^\\w]*?)([A-Za-z]+).*</[Aa]nswer>", flags=re.DOTALL)
+_MULTIPLE_CHOICES_PATTERN = re.compile("[ABCDabcd]\\W{0,2}[ABCDabcd](\\W{0,2}[ABCDabcd]){0,2}(\\W|$)")
+_FIRST_NUMBERS_PATTERN = re.compile("^[^0-9]*?([^0-9]?)(-?([0-9]+[.,])*[0-9]+)([^0-9]?)")
+_LAST_NUMBERS_PATTERN = re.compile("([^0-9]?)(-?([0-9]+[.,])*[0-9]+)([^0-9]?)[^0-9]*?$")
+_ANSWER_PATTERN = re.compile("[Aa]nswer:([^\\w]*?)([A-Za-z]+)")
+_ANSWER_ZH_PATTERN = re.compile("答案[：:]([^\\w]*?)([A-Za-z]+)")
+# Same as [A-Za-z] for the letter scans. str.isalpha alone also accepts non-ASCII letters e.g. CJK characters.
+_ASCII_LETTERS = frozenset(string.ascii_letters)
+
 def as_is(response: str):
     """
     No preprocessing, no validation, just "as-is".
@@ -29,20 +41,19 @@ def mcq_search_preprocessor(response: str):
     - :None response content: NONE_CONTENT_ERROR_MSG ('Received None content.')
     - :Malformed answer (No valid \<answer\> field): ANSWER_FAILED_MSG ("No valid answer field was found. Fall back to false.")
     """
-    def _extract_answer(s: str):
-        # Remove latex boxed statement e.g. `\boxed{A}`
-        unboxed = s.replace("\\boxed", " ")
+    return _MCQ_SEARCH_PIPELINE(response)
 
-        pattern = f"<[Aa]nswer>([^\\w]*?)([A-Za-z]+).*</[Aa]nswer>"
-        match = re.search(pattern, unboxed, flags=re.DOTALL)
-        if match != None:
-            # Only pick if the first letter of the group is independent. e.g. `Answer: A` but not `Answer: Shark` 
-            state = pick_first_letter_if_independent(match.group(2))
-            if state:
-                return state.upper()
-        return ANSWER_FAILED_MSG
-    
-    return preprocess_pipeline(response, _extract_answer)
+def _extract_answer_tag(s: str):
+    # Remove latex boxed statement e.g. `\boxed{A}`
+    unboxed = s.replace("\\boxed", " ")
+
+    match = _ANSWER_TAG_PATTERN.search(unboxed)
+    if match != None:
+        # Only pick if the first letter of the group is independent. e.g. `Answer: A` but not `Answer: Shark` 
+        state = pick_first_letter_if_independent(match.group(2))
+        if state:
+            return state.upper()
+    return ANSWER_FAILED_MSG
 
 def mcq_preprocessor(response: str):
     """
@@ -54,14 +65,11 @@ def mcq_preprocessor(response: str):
     - :Unrecognizable independent letters: ""
     - :Others: ` A. answer` => `A`
     """
-    
-    def _handle_both_ends(s: str):
-        first_independent_letter = pick_first_letter_if_independent(s)
-        return first_independent_letter if first_independent_letter else pick_last_letter_if_independent(s)
-    
-    return preprocess_pipeline(response, 
-                               _handle_both_ends,
-                               lambda s: s.upper())
+    return _MCQ_PIPELINE(response)
+
+def _handle_both_ends(s: str):
+    first_independent_letter = pick_first_letter_if_independent(s)
+    return first_independent_letter if first_independent_letter else pick_last_letter_if_independent(s)
 
 def mcq_cot_preprocessor(response: str):
     """
@@ -72,14 +80,7 @@ def mcq_cot_preprocessor(response: str):
     - :Valid cot but Empty conclusion: THINK_FAILED_MSG
     - :Otherwise: as in mcq_preprocessor
     """
-    def _handle_both_ends(s: str):
-        first_independent_letter = pick_first_letter_if_independent(s)
-        return first_independent_letter if first_independent_letter else pick_last_letter_if_independent(s)
-    
-    return preprocess_pipeline(response, 
-                               remove_think_tags, 
-                               _handle_both_ends,
-                               lambda s: s.upper())
+    return _MCQ_COT_PIPELINE(response)
     
 def mcq_cot_preprocessor_for_bad_if(response:str):
     """
@@ -92,37 +93,33 @@ def mcq_cot_preprocessor_for_bad_if(response:str):
     - :Regular: The last alphabetical character uppercased `The correct answer is: A.` => `A`
     - :No match: ""
     """
+    return _MCQ_COT_FOR_BAD_IF_PIPELINE(response)
+
+def _remove_multiple_choices(s: str):
+    """
+    Answer: A/B/C/D (X)
+    """
+    return _MULTIPLE_CHOICES_PATTERN.sub("", s)
+
+def _catch_bad_cot_pipeline(s: str):
+    """
+    These conditional makes the component methods not individually chainable to pipeline:
     
-    def remove_multiple_choices(s: str):
-        """
-        Answer: A/B/C/D (X)
-        """
-        return re.sub("[ABCDabcd]\\W{0,2}[ABCDabcd](\\W{0,2}[ABCDabcd]){0,2}(\\W|$)", "", s)
+    - :ERROR MSG flags input: immediately return the flag
     
-    def _catch_bad_cot_pipeline(s: str):
-        """
-        These conditional makes the component methods not individually chainable to pipeline:
-        
-        - :ERROR MSG flags input: immediately return the flag
-        
-        - :letter selection with fallbacks:
-        
-        - search_for_answer decision upon no independent letter is found from both ends 
-
-        """
-        state = pick_last_letter_if_independent(s)
-        # e.g.  "Answer: B" -> "B" 
-        
-        state = state if state else pick_first_letter_if_independent(s)
-        # Try to catch if the first letter is the answer
-        
-        return state.upper() if state else search_for_answer(s)
-        # e.g. "Answer: B\nThe above is the answer." => "B"
+    - :letter selection with fallbacks:
+    
+    - search_for_answer decision upon no independent letter is found from both ends 
 
-    return preprocess_pipeline(response, 
-                               remove_multiple_choices,
-                               remove_think_tags,
-                               _catch_bad_cot_pipeline)
+    """
+    state = pick_last_letter_if_independent(s)
+    # e.g.  "Answer: B" -> "B" 
+    
+    state = state if state else pick_first_letter_if_independent(s)
+    # Try to catch if the first letter is the answer
+    
+    return state.upper() if state else search_for_answer(s)
+    # e.g. "Answer: B\nThe above is the answer." => "B"
 
 def clean_humaneval_preprocessor(response: str) -> str:
     """
@@ -134,12 +131,7 @@ def clean_humaneval_cot_preprocessor(response: str) -> str:
     """
     Equivalent of clean_humaneval_preprocessor, but for models supporting cot, as deepseek r1 distill models.
     """
-    def _catch_bad_cot_and_clean(s: str) -> str:
-        return s.strip("`").lstrip("python")
-    
-    return preprocess_pipeline(response,
-                               remove_think_tags,
-                               _catch_bad_cot_and_clean)
+    return _CLEAN_HUMANEVAL_COT_PIPELINE(response)
     
 def model_binary_scoring_cot_preprocessor(response: str) -> str:
     """
@@ -147,23 +139,22 @@ def model_binary_scoring_cot_preprocessor(response: str) -> str:
     
     On failure to parse, return "".
     """
-    # Parse a scoring model message into a binary int score.
-    def _catch_bad_cot_pipeline(s: str):
-        # Requires remove_think_tags first
-        s = remove_think_tags(s)
-        if s in (THINK_FAILED_MSG, NONE_CONTENT_ERROR_MSG):
-            return "" # In scoring, no need to return flag
-        
-        state = pick_first_numbers_if_independent(s)
-        if not filter_non_binary_scores(state):
-            # The first numeric substring is not independent e.g. amici1000
-            # Use last numeric substring
-            last_numeric_substring = pick_last_numbers_if_independent(state)
-            return last_numeric_substring if filter_non_binary_scores(last_numeric_substring) else ""
-        return state
-    
-    return preprocess_pipeline(response, 
-                               _catch_bad_cot_pipeline)
+    return _MODEL_BINARY_SCORING_COT_PIPELINE(response)
+
+# Parse a scoring model message into a binary int score.
+def _catch_bad_scoring_cot_pipeline(s: str):
+    # Requires remove_think_tags first
+    s = remove_think_tags(s)
+    if s in (THINK_FAILED_MSG, NONE_CONTENT_ERROR_MSG):
+        return "" # In scoring, no need to return flag
+    
+    state = pick_first_numbers_if_independent(s)
+    if not filter_non_binary_scores(state):
+        # The first numeric substring is not independent e.g. amici1000
+        # Use last numeric substring
+        last_numeric_substring = pick_last_numbers_if_independent(state)
+        return last_numeric_substring if filter_non_binary_scores(last_numeric_substring) else ""
+    return state
 
 def model_binary_scoring_preprocessor(response: str) -> str:
     """
@@ -171,18 +162,16 @@ def model_binary_scoring_preprocessor(response: str) -> str:
     
     On failure to parse, return "".
     """
-    def _catch_non_binary_score_pipeline(s: str):
-        # Requires pick_first_numbers_if_independent first
-        if not filter_non_binary_scores(s):
-            # The first numeric substring is not independent e.g. amici1000
-            # Use last numeric substring
-            last_numeric_substring = pick_last_numbers_if_independent(s)
-            return last_numeric_substring if filter_non_binary_scores(last_numeric_substring) else ""
-        return s
+    return _MODEL_BINARY_SCORING_PIPELINE(response)
 
-    return preprocess_pipeline(response, 
-                               pick_first_numbers_if_independent, 
-                               _catch_non_binary_score_pipeline)
+def _catch_non_binary_score_pipeline(s: str):
+    # Requires pick_first_numbers_if_independent first
+    if not filter_non_binary_scores(s):
+        # The first numeric substring is not independent e.g. amici1000
+        # Use last numeric substring
+        last_numeric_substring = pick_last_numbers_if_independent(s)
+        return last_numeric_substring if filter_non_binary_scores(last_numeric_substring) else ""
+    return s
 
 def pick_first_letter_if_independent(s: str) -> str:
     """
@@ -203,17 +192,16 @@ def pick_first_letter_if_independent(s: str) -> str:
     
     unboxed = s.replace("\\boxed", " ")
     
-    # Pick the first letter with immediately adjacent letters. 
-    # For obvious reason, the previous character should not be alphabatical.
-    pattern = "^[^A-Za-z]*?([^A-Za-z]?)([A-Za-z])(.?)"
-    match = re.search(pattern, unboxed)
+    # Scan for the first letter with its immediately adjacent characters. It usually comes within the first few characters.
+    # For obvious reason, the previous character is not alphabatical.
+    for i, char in enumerate(unboxed):
+        if char in _ASCII_LETTERS:
+            # Are adjacent characters alphanumeric?
+            if (i > 0 and unboxed[i - 1].isalnum()) or unboxed[i + 1:i + 2].isalnum():
+                return ""
+            return char
     
-    # None match = no alphabetical characeter found
-    if match != None:
-        # Are adjacent characters alphanumeric?
-        if not match.group(1).isalnum() and not match.group(3).isalnum():
-            return match.group(2)
-        
+    # No alphabetical characeter found
     return ""
 
 def pick_last_letter_if_independent(s: str) -> str:
@@ -233,17 +221,16 @@ def pick_last_letter_if_independent(s: str) -> str:
     - :The most probable cell is A10.: "" (A is adjacent to 1, not independent)
     """
 
-    # Pick the last letter with immediately adjacent letters.
-    # For obvious reason, the following character should not be alphabatical.
-    pattern = "(.?)([A-Za-z])([^A-Za-z]?)[^A-Za-z]*?$"
-    match = re.search(pattern, s)
-    
-    # None match = no alphabetical characeter found
-    if match != None:
-        # Are adjacent characters alphanumeric?
-        if not match.group(1).isalnum() and not match.group(3).isalnum():
-            return match.group(2)
-        
+    # Scan backwards for the last letter with its immediately adjacent characters.
+    # For obvious reason, the following character is not alphabatical.
+    for i in range(len(s) - 1, -1, -1):
+        if s[i] in _ASCII_LETTERS:
+            # Are adjacent characters alphanumeric?
+            if (i > 0 and s[i - 1].isalnum()) or s[i + 1:i + 2].isalnum():
+                return ""
+            return s[i]
+    
+    # No alphabetical characeter found
     return ""
 
 def pick_first_numbers_if_independent(s: str) -> str:
@@ -264,8 +251,7 @@ def pick_first_numbers_if_independent(s: str) -> str:
     #   - optional percentage mark
     #   - shrinkable "[0-9]+[,.]" group, as in 1,000,000 where "1," and "000," form two extra groups
     #   - optional minus sign
-    pattern = "^[^0-9]*?([^0-9]?)(-?([0-9]+[.,])*[0-9]+)([^0-9]?)"
-    match = re.search(pattern, s)
+    match = _FIRST_NUMBERS_PATTERN.search(s)
     
     # None match = no alphabetical characeter found
     if match != None:
@@ -296,8 +282,7 @@ def pick_last_numbers_if_independent(s: str) -> str:
     #   - optional percentage mark
     #   - shrinkable "[0-9]+[,.]" group, as in 1,000,000 where "1," and "000," form two extra groups
     #   - optional minus sign
-    pattern = "([^0-9]?)(-?([0-9]+[.,])*[0-9]+)([^0-9]?)[^0-9]*?$"
-    match = re.search(pattern, s)
+    match = _LAST_NUMBERS_PATTERN.search(s)
     
     # None match = no alphabetical characeter found
     if match != None:
@@ -311,25 +296,29 @@ def pick_last_numbers_if_independent(s: str) -> str:
             return match.group(2).replace(",","")
     return ""
 
-@DeprecationWarning
 def search_for_answer(s: str):
-    # Deprecated.
+    # Deprecated. Only kept as the last fallback of mcq_cot_preprocessor_for_bad_if.
+    # Not decorated with @DeprecationWarning: that replaced the function with an exception instance, so the fallback raised TypeError instead of searching.
+    
+    # Neither pattern can match without its marker. Skip copying and scanning the whole response.
+    if "nswer:" not in s and "答案" not in s:
+        logger.error(f"Failed to parse answer from response: {s[:50]}")
+        return ""
+    
     # Remove latex boxed statement e.g. `\boxed{A}`
     unboxed = s.replace("\\boxed", " ")
     
     # Allow multiple non-word characters before the first alphabetical (A-Za-z) group after "Answer:".
     # Model might use "**A**" or adding arbitrary spaces around the letter.
     # This is not matched: `Answer: not sure`
-    pattern = f"[Aa]nswer:([^\\w]*?)([A-Za-z]+)"
-    match = re.search(pattern, unboxed)
+    match = _ANSWER_PATTERN.search(unboxed)
     if match != None:
         # Only pick if the first letter of the group is independent. e.g. `Answer: A` but not `Answer: Shark` 
         state = pick_first_letter_if_independent(match.group(2))
         if state:
             return state.upper()
         
-    pattern_zh = f"答案[：:]([^\\w]*?)([A-Za-z]+)"
-    match_zh = re.search(pattern_zh, unboxed)
+    match_zh = _ANSWER_ZH_PATTERN.search(unboxed)
     if match_zh != None:
         # Same as above.
         state2 = pick_first_letter_if_independent(match_zh.group(2))
@@ -340,12 +329,14 @@ def search_for_answer(s: str):
     return ""
     
 def remove_think_tags(s: str):
-    removed = re.sub(".*</[Tt]hink>", "", s, flags=re.DOTALL)
+    # Drop everything up to the last closing think tag. Searched from the end with str.rfind: a regex would rescan the rest of the response from every position when the tag is missing.
+    think_end = max(s.rfind("</think>"), s.rfind("</Think>"))
     
     # If no cot is parsed at all, return a fallback message string.
-    if len(removed) == len(s):
+    if think_end == -1:
         logger.warning(f"Encountered malformed cot section. The cot is likely incomplete. Will fall back to think failed msg.")
         return THINK_FAILED_MSG
+    removed = s[think_end + len("</think>"):]
     if len(removed.strip()) == 0:
         logger.warning("Despite cot being complete, no answer was made. Will fall back to think failed msg.")
         return THINK_FAILED_MSG
@@ -368,17 +359,37 @@ def filter_non_binary_scores(s: str):
     
     return s if s in "01" else ""
     
+# Flags that halt a pipeline and are returned as is
+_FLAG_MSGS = (THINK_FAILED_MSG, ANSWER_FAILED_MSG, NONE_CONTENT_ERROR_MSG)
+
 def preprocess_pipeline(str_to_preprocess: str, *preprocessors):
     """
     Execute a series of preprocessors with empty string detection.
     """
     state = str_to_preprocess
     for func in preprocessors:
-        if state in (THINK_FAILED_MSG, ANSWER_FAILED_MSG, NONE_CONTENT_ERROR_MSG):
+        if state in _FLAG_MSGS:
             return state
         if state != "":
             state = func(state)
             continue
         logger.warning(f"Processed response is empty. Preprocessing halted.")
         return ""
-    return state
\ No newline at end of file
+    return state
+
+def make_pipeline(*preprocessors) -> Callable[[str], str]:
+    """
+    Bind a series of preprocessors into a single preprocessor, same as `preprocess_pipeline` with these preprocessors. Build it once and reuse it, instead of passing the preprocessors on every call.
+    """
+    def pipeline(str_to_preprocess: str) -> str:
+        return preprocess_pipeline(str_to_preprocess, *preprocessors)
+    return pipeline
+
+# Pipelines of the presets above, built once at import
+_MCQ_SEARCH_PIPELINE = make_pipeline(_extract_answer_tag)
+_MCQ_PIPELINE = make_pipeline(_handle_both_ends, str.upper)
+_MCQ_COT_PIPELINE = make_pipeline(remove_think_tags, _handle_both_ends, str.upper)
+_MCQ_COT_FOR_BAD_IF_PIPELINE = make_pipeline(_remove_multiple_choices, remove_think_tags, _catch_bad_cot_pipeline)
+_CLEAN_HUMANEVAL_COT_PIPELINE = make_pipeline(remove_think_tags, clean_humaneval_preprocessor)
+_MODEL_BINARY_SCORING_COT_PIPELINE = make_pipeline(_catch_bad_scoring_cot_pipeline)
+_MODEL_BINARY_SCORING_PIPELINE = make_pipeline(pick_first_numbers_if_independent, _catch_non_binary_score_pipeline)
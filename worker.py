@@ -1,4 +1,5 @@
-from request_manager.request_manager import process_batch
+from request_manager.request_manager import process_batch, warm_up
+from request_manager.rate_limiter import RATE_LIMIT_RPM, RATE_LIMIT_TPM, RateLimiter
 from dataset_models import QuerySet, ResponseSet
 from typing import Union, Dict, Any
 
@@ -164,45 +165,50 @@ class Worker:
             """
             return self.worker
         
-        async def invoke(self, enable_metrics=False):
+        async def invoke(self, enable_metrics=False, dedup=True):
             """
             Start this job.
+            
+            :params bool enable_metrics: Whether to read "usage" key from response body. Each query gets "input_tokens", "output_tokens" and "cached". Responses read from the cache, or shared with an identical request of another batch, count 0 tokens.
+            :params bool dedup: Send identical queries only once. Set to False to sample each of them independently.
             """
             worker = self.worker
             query_key = self.query_key
             response_key = self.response_key
-            # queries: list({query_key: <query_str>})
-            queries = self.query_set.get_queries()
-            
             # Acquire a query string list
-            query_string_list = [query[query_key] for query in queries]
+            query_string_list = self.query_set.get_column(query_key)
+            
+            # queries: list({query_key: <query_str>})
+            # Responses only add top-level keys. Copy each query object instead of deep copying the whole query set.
+            queries = [dict(query) for query in self.query_set.queries]
             
             # Launch requests
             params: dict[str, Any] = worker.get_params()
-            batch_results = await process_batch(query_string_list, params, enable_metrics=enable_metrics)
+            batch_results = await process_batch(query_string_list, params, enable_metrics=enable_metrics, dedup=dedup, rate_limiter=worker.rate_limiter)
 
             # Post works
-            if enable_metrics:
-                for query, result_obj in zip(queries, batch_results):
-                    if result_obj.get("reasoning_content", None) is not None:
-                        query.update({"reasoning_content": result_obj["reasoning_content"]})
-                    query.update({
-                        response_key: result_obj["content"],
-                        "input_tokens": result_obj["prompt_tokens"],
-                        "output_tokens": result_obj["completion_tokens"]
-                        })
-            else:
-                for query, result_obj in zip(queries, batch_results):
-                    if result_obj.get("reasoning_content", None) is not None:
-                        query.update({"reasoning_content": result_obj["reasoning_content"]})
-                    query.update({
-                        response_key: result_obj["content"],
-                        })
+            # Set the fields one by one instead of building a temporary dict per query for update()
+            for query, result_obj in zip(queries, batch_results):
+                reasoning_content = result_obj.get("reasoning_content")
+                if reasoning_content is not None:
+                    query["reasoning_content"] = reasoning_content
+                query[response_key] = result_obj["content"]
+                if enable_metrics:
+                    query["input_tokens"] = result_obj["prompt_tokens"]
+                    query["output_tokens"] = result_obj["completion_tokens"]
+                    query["cached"] = result_obj.get("cached", False)
 
             return ResponseSet(queries, query_key=query_key, response_key=response_key)
         
-    def __init__(self, request_params: RequestParams):
+    def __init__(self, request_params: RequestParams, rpm: int = RATE_LIMIT_RPM, tpm: int = RATE_LIMIT_TPM):
+        """
+        :params RequestParams request_params: Model and request parameters of this worker.
+        :params int rpm: Requests per minute allowed for this worker. Default to RATE_LIMIT_RPM in .env file. 0 = no limit
+        :params int tpm: Tokens per minute allowed for this worker. Default to RATE_LIMIT_TPM in .env file. 0 = no limit
+        """
         self.request_params = request_params
+        # Shared by all jobs of this worker, so concurrent subsets draw from the same buckets
+        self.rate_limiter = RateLimiter(rpm, tpm)
         
     def __call__(self, query_set: QuerySet, query_key="query", response_key="response"):
         """
@@ -216,6 +222,12 @@ class Worker:
         """
         return self.Job(self, query_set, query_key, response_key)
         
+    async def warm_up(self):
+        """
+        Open connections to the api of this worker (WARM_UP_CONNECTIONS) and optionally send it a 1-token request (WARM_UP_REQUEST), before the first job is invoked. Does nothing unless enabled in .env file.
+        """
+        await warm_up(self.get_params())
+        
     def get_params(self):
         """
         :return dict[str, Any]: The parameters to initialize this worker. Modifying this dict does not affect the worker.